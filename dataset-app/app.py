@@ -1,25 +1,27 @@
 import streamlit as st
-from PIL import Image
-import torch
 from stqdm import stqdm
-from utils import *
+from spina_bifida import enable_metrics_from_env, manifest_bytes, manifest_rows, processor_from_env, upload_queue_from_env
 from dotenv import load_dotenv
-import boto3
-from botocore.exceptions import NoCredentialsError
 import os
 import uuid
 import json
+import hashlib
 
 # Загрузка переменных окружения из .env файла
 load_dotenv()
 
 
-BUCKET = os.getenv('BUCKET')
 ORG_LIST = os.getenv('ORG_ID')
+BATCH_SIZE = int(os.getenv('BATCH_SIZE') or 16)
+# Формат аннотаций: 'json' - отдельный объект на изображение, 'jsonl'/'parquet' - один манифест на партию
+ANNOTATION_FORMAT = os.getenv('ANNOTATION_FORMAT') or 'json'
 IFRAME = '<iframe src="https://ghbtns.com/github-btn.html?user=yandex-cloud-socialtech&repo=spina-bifida&type=watch&count=true&size=large" frameborder="0" scrolling="0" width="121" height="30" title="GitHub"></iframe>'
 
 result = {}
 
+# Метрики стадий обработки и загрузок (экспортер Prometheus на METRICS_PORT, запускается один раз на процесс)
+enable_metrics_from_env()
+
 # Настройки страницы
 st.set_page_config(
      page_title='Dataset spina bifida uploader',
@@ -58,62 +60,66 @@ def show_terms_modal():
 
     return accept
 
-# Функция записи на S3
-def upload_to_yandex_cloud(file, file_name, bucket, object_name=None):
-    ACCESS_KEY = os.getenv('ACCESS_KEY')
-    SECRET_KEY = os.getenv('SECRET_KEY')
-    ENDPOINT_URL = 'https://storage.yandexcloud.net'
-
-    session = boto3.session.Session()
-    s3 = session.client(
-        service_name='s3',
-        endpoint_url=ENDPOINT_URL,
-        aws_access_key_id=ACCESS_KEY,
-        aws_secret_access_key=SECRET_KEY
-    )
-    try:
-        s3.upload_file(file_name, bucket, object_name or file_name)
-        # st.success(f"Файл {file_name} успешно загружен в Yandex Object Storage.")
-        os.remove(file_name) # Удаление локального файла после успешной загрузки
-    except FileNotFoundError:
-        st.error("The file was not found.")
-    except NoCredentialsError:
-        st.error("An error with the credentials.")
-    except Exception as e:
-        st.error(f"An error has occurred: {e}")
+# Очередь загрузок в Object Storage: один клиент, пул потоков и фоновый поток на процесс
+@st.cache_resource
+def get_upload_queue():
+    return upload_queue_from_env(default_workers=8)
+
+# Функция записи на S3 (objects - список пар: данные в bytes, имя объекта).
+# Объекты ставятся в очередь и загружаются в фоне, интерфейс не ждет Object Storage
+def upload_to_yandex_cloud(objects):
+    upload_queue.enqueue(objects)
 
 # Функция настройки моделей
 @st.cache_resource(show_spinner = "Load model ...")
 def get_processor():
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    return MedicalImageProcessor(
-        yolo_model_path='models/best_object_detection.pt',
-        axial_quality_model_path='models/axial_quality.pt',
-        axial_pathology_model_path='models/axial_pathology.pt',
-        sagittal_quality_model_path='models/sagittal_quality.pt',
-        sagittal_pathology_model_path='models/sagittal_pathology.pt',
-        device=device
-    )
-
-# Функции обработки изображений
-@st.cache_data(show_spinner = "Image processing ...", ttl = 3600, max_entries = 100)
-def cache_process_image(img_bytes, img_name):
-    return processor.process_image(img_bytes, img_name)
+    # Процессор общий для всех сессий: одновременные запросы объединяются в пакеты и выполняются в одном потоке.
+    # Если задан адрес сервиса инференса (INFERENCE_URL), модели в процессе Streamlit не загружаются
+    return processor_from_env('models')
 
+# Функции обработки изображений (в аннотацию пишутся только вероятности, тепловые карты не нужны)
+# Результаты хранятся в сессии по SHA-256 байтов файла и имени, при перезапусках скрипта файлы повторно не обрабатываются
 def process_uploaded_files(uploaded_files):
-    with stqdm(uploaded_files, mininterval=1) as pbar:
-        st.session_state['imgs'] = {}
-        st.session_state['processed_images'] = {}
-        for uploaded_file in pbar:
-            img = Image.open(uploaded_file)
-            img_bytes = io.BytesIO()
-            img.save(img_bytes, format='PNG')
-            img_bytes = img_bytes.getvalue()
-            img_name = uploaded_file.name
-            if img_name not in st.session_state['imgs']:
-                result = cache_process_image(img_bytes, img_name)
-                st.session_state['imgs'][img_name] = img
-                st.session_state['processed_images'][img_name] = result
+    cached = st.session_state.get('results', {})
+    st.session_state['files'] = {}
+    st.session_state['processed_images'] = {}
+    st.session_state['results'] = {}
+    images = []
+    keys = []
+    for uploaded_file in uploaded_files:
+        img_name = uploaded_file.name
+        if img_name not in st.session_state['files']:
+            file_bytes = uploaded_file.getvalue()
+            key = (hashlib.sha256(file_bytes).hexdigest(), img_name)
+            st.session_state['files'][img_name] = file_bytes
+            if key in cached:
+                st.session_state['results'][key] = st.session_state['processed_images'][img_name] = cached[key]
+                continue
+            # Байты файла передаются в конвейер: декодирование идет в пуле потоков параллельно с моделями
+            images.append((file_bytes, img_name))
+            keys.append(key)
+
+    if not images:
+        return
+    # Результаты выдаются по мере готовности, поэтому прогресс отражает реальную обработку
+    stream = processor.process_stream(images, compute_heatmaps=False, batch_size=BATCH_SIZE)
+    for key, result in zip(keys, stqdm(stream, total=len(images), mininterval=1)):
+        st.session_state['results'][key] = st.session_state['processed_images'][key[1]] = result
+
+# Аннотация одной области интереса
+def roi_annotation(roi):
+    return {
+        'prediction': roi["plane"]['prediction_prob'].tolist(),
+        'plane': roi["plane"]['plane'],
+        'box': {
+            'x1': roi["plane"]['box'][0].tolist(),
+            'y1': roi["plane"]['box'][1].tolist(),
+            'x2': roi["plane"]['box'][2].tolist(),
+            'y2': roi["plane"]['box'][3].tolist()
+            },
+        'quality': roi["quality"]["prediction_prob"],
+        'pathology': roi["pathology"]["prediction_prob"]
+        }
 
 # Функция генерации уникального идентификатора файла
 def get_unique_id():
@@ -156,15 +162,19 @@ else:
         )
         
         processor = get_processor()
+        upload_queue = get_upload_queue()
         
         if uploaded_files:
             process_uploaded_files(uploaded_files)
 
             processed_images = st.session_state['processed_images']
-            imgs = st.session_state['imgs']
 
             files = list(processed_images.keys())
             count = 0
+            uploads = []
+            submission_id = get_unique_id()
+            model_version = processor.model_version if ANNOTATION_FORMAT != 'json' else None
+            manifest = []
             for file in files:
                 uniquie_id = get_unique_id()
                 annotation_file_name = f'annotation_{uniquie_id}_{file}.json'
@@ -185,17 +195,18 @@ else:
                                     'x2': processed_images[file]["plane"]['box'][2].tolist(),
                                     'y2': processed_images[file]["plane"]['box'][3].tolist()
                                     }
-                                }
+                                },
+                        # Все найденные области интереса (первая совпадает с 'roi')
+                        'rois': [roi_annotation(roi) for roi in processed_images[file]["rois"]]
                         }
                     count += 1
-                    # Временное хранение файлов
-                    st.session_state['imgs'][file].save(img_file_name)
-                    with open(annotation_file_name, 'w') as f:
-                        json.dump(res, f)
                 
-                    # Запись на S3
-                    upload_to_yandex_cloud(file, img_file_name, BUCKET, f'data/{img_file_name}')
-                    upload_to_yandex_cloud(file, annotation_file_name, BUCKET, f'annotation/{annotation_file_name}')
+                    # Запись на S3 из памяти (параллельно, после обработки всех файлов)
+                    uploads.append((st.session_state['files'][file], f'data/{img_file_name}'))
+                    if ANNOTATION_FORMAT == 'json':
+                        uploads.append((json.dumps(res).encode(), f'annotation/{annotation_file_name}'))
+                    else:
+                        manifest.extend(manifest_rows(res, f'data/{img_file_name}', submission_id, model_version))
 
                 except:
                     res = {
@@ -205,17 +216,21 @@ else:
                         'error': 'ROI not found'
                     }
 
-                    # Временное хранение файлов
-                    st.session_state['imgs'][file].save(img_file_name)
-                    with open(annotation_file_name, 'w') as f:
-                        json.dump(res, f)
-
-                    # Запись на S3
-                    upload_to_yandex_cloud(file, img_file_name, BUCKET, f'no_roi_data/{img_file_name}')
-                    upload_to_yandex_cloud(file, annotation_file_name, BUCKET, f'no_roi_annotation/{annotation_file_name}')
+                    # Запись на S3 из памяти (параллельно, после обработки всех файлов)
+                    uploads.append((st.session_state['files'][file], f'no_roi_data/{img_file_name}'))
+                    if ANNOTATION_FORMAT == 'json':
+                        uploads.append((json.dumps(res).encode(), f'no_roi_annotation/{annotation_file_name}'))
+                    else:
+                        manifest.extend(manifest_rows(res, f'no_roi_data/{img_file_name}', submission_id, model_version))
                     
 
 
+            # Аннотации всей партии - одним манифестом
+            if manifest:
+                uploads.append((manifest_bytes(manifest, ANNOTATION_FORMAT), f'manifests/manifest_{submission_id}.{ANNOTATION_FORMAT}'))
+
+            upload_to_yandex_cloud(uploads)
+
             # Вывод информации о загруженных и обработанных файлах
             col1, col2 = st.columns(2)
             with col1:
@@ -223,6 +238,9 @@ else:
             with col2:
                 st.metric(label='ROI detected', value=count)
 
+            upload_stats = upload_queue.stats()
+            st.caption(f'Upload queue: {upload_stats["depth"]} objects, lag {upload_stats["lag"]:.0f} s')
+
             st.success(f'Thank you for your contribution! To upload more files, press *Ctrl+R* (*Cmd+R*) to restart the application.', icon="✅")
 
 
@@ -0,0 +1,50 @@
+import argparse
+import io
+import os
+
+import boto3
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+from spina_bifida import read_manifest
+
+# Сборка сводного индекса датасета из манифестов партий (manifests/*.jsonl, *.parquet) в один Parquet-файл.
+# Манифесты, уже учтенные в индексе (колонка manifest), повторно не читаются.
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compact submission manifests into a dataset index')
+    parser.add_argument('--manifests-prefix', default='manifests/')
+    parser.add_argument('--index-key', default='index/dataset_index.parquet')
+    args = parser.parse_args()
+
+    load_dotenv()
+    bucket = os.getenv('BUCKET')
+    s3 = boto3.session.Session().client(
+        service_name='s3',
+        endpoint_url='https://storage.yandexcloud.net',
+        aws_access_key_id=os.getenv('ACCESS_KEY'),
+        aws_secret_access_key=os.getenv('SECRET_KEY')
+    )
+
+    try:
+        rows = pq.read_table(io.BytesIO(s3.get_object(Bucket=bucket, Key=args.index_key)['Body'].read())).to_pylist()
+    except s3.exceptions.NoSuchKey:
+        rows = []
+    compacted = {row['manifest'] for row in rows}
+
+    new_manifests = 0
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=args.manifests_prefix):
+        for obj in page.get('Contents', []):
+            key = obj['Key']
+            if key in compacted:
+                continue
+            data = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+            for row in read_manifest(data, os.path.splitext(key)[1].lstrip('.')):
+                row['manifest'] = key
+                rows.append(row)
+            new_manifests += 1
+
+    buffer = io.BytesIO()
+    pq.write_table(pa.Table.from_pylist(rows), buffer)
+    s3.put_object(Bucket=bucket, Key=args.index_key, Body=buffer.getvalue())
+    print(f'{new_manifests} new manifests, {len(rows)} rows in {args.index_key}')
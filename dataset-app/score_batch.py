@@ -0,0 +1,199 @@
+import argparse
+import collections
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import torch
+from botocore.config import Config
+from dotenv import load_dotenv
+
+from spina_bifida import MedicalImageProcessor, decode_image, manifest_bytes
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Пакетная переоценка архива снимков без Streamlit: локальный каталог или префикс бакета (s3://bucket/prefix).
+# Файлы читаются и декодируются в пуле потоков с упреждением, модели получают пакеты по --batch-size.
+# Результаты дописываются в JSONL или в каталог частей Parquet, обработанные файлы - в файл контрольной точки,
+# поэтому прерванный запуск продолжается с места остановки (пакет, записанный до сбоя контрольной точки, может повториться).
+
+def list_local(path):
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, name)
+
+def list_s3(s3, bucket, prefix):
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'].lower().endswith(IMAGE_EXTENSIONS):
+                yield obj['Key']
+
+def prefetch(keys, load, workers, depth):
+    """
+    Загрузка и декодирование в пуле потоков: впереди модели не более depth изображений.
+    Возвращает пары (ключ, Future) в порядке keys.
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='decode') as executor:
+        pending = collections.deque()
+        for key in keys:
+            pending.append((key, executor.submit(load, key)))
+            if len(pending) >= depth:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+def result_rows(result, source, model_version):
+    """
+    Строки результата: по строке на каждую область интереса или одна строка с ошибкой.
+    """
+    if "error" in result:
+        return [{'source': source, 'roi_index': None, 'plane': None, 'plane_prob': None, 'x1': None, 'y1': None, 'x2': None, 'y2': None,
+                 'quality': None, 'pathology': None, 'model_version': model_version, 'error': result["error"]}]
+    rows = []
+    for roi_index, roi in enumerate(result["rois"]):
+        x1, y1, x2, y2 = [float(x) for x in roi["plane"]["box"]]
+        rows.append({
+            'source': source,
+            'roi_index': roi_index,
+            'plane': roi["plane"]["plane"],
+            'plane_prob': float(roi["plane"]["prediction_prob"]),
+            'x1': x1,
+            'y1': y1,
+            'x2': x2,
+            'y2': y2,
+            'quality': float(roi["quality"]["prediction_prob"]),
+            'pathology': float(roi["pathology"]["prediction_prob"]),
+            'model_version': model_version,
+            'error': None
+        })
+
+    return rows
+
+def write_rows(rows, output, fmt):
+    if fmt == 'jsonl':
+        with open(output, 'ab') as f:
+            f.write(manifest_bytes(rows, 'jsonl'))
+            f.flush()
+            os.fsync(f.fileno())
+    else:
+        # Parquet не дописывается: каждый пакет - отдельная часть в каталоге output
+        os.makedirs(output, exist_ok=True)
+        part = len([name for name in os.listdir(output) if name.endswith('.parquet')])
+        with open(os.path.join(output, f'part-{part:05d}.parquet'), 'wb') as f:
+            f.write(manifest_bytes(rows, 'parquet'))
+
+def save_heatmaps(result, source, heatmaps_dir):
+    name = os.path.splitext(source.lstrip('/'))[0]
+    for roi_index, roi in enumerate(result.get("rois", [])):
+        for task in ('quality', 'pathology'):
+            path = os.path.join(heatmaps_dir, f'{name}_{roi_index}_{task}.png')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            roi[task]["heatmap"].save(path)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score a directory or an S3 prefix of ultrasound frames')
+    parser.add_argument('source', help='Local directory or s3://bucket/prefix')
+    parser.add_argument('output', help='JSONL file or Parquet directory')
+    parser.add_argument('--format', choices=['jsonl', 'parquet'], default='jsonl')
+    parser.add_argument('--checkpoint', help='File with processed inputs (default: <output>.checkpoint)')
+    parser.add_argument('--models-dir', default='models')
+    parser.add_argument('--backend', default=os.getenv('INFERENCE_BACKEND') or 'torch')
+    parser.add_argument('--quantized', action='store_true')
+    parser.add_argument('--num-threads', type=int)
+    parser.add_argument('--batch-size', type=int, default=int(os.getenv('BATCH_SIZE') or 16))
+    parser.add_argument('--workers', type=int, default=8, help='Read and decode threads')
+    parser.add_argument('--prefetch', type=int, default=64, help='Max decoded images waiting for the model')
+    parser.add_argument('--max-rois', type=int)
+    parser.add_argument('--heatmaps-dir', help='Compute Grad-CAM++ heatmaps and save them as PNG')
+    parser.add_argument('--endpoint-url', default='https://storage.yandexcloud.net')
+    args = parser.parse_args()
+
+    load_dotenv()
+    checkpoint = args.checkpoint or args.output.rstrip('/') + '.checkpoint'
+    done = set()
+    if os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            done = {line.rstrip('\n') for line in f if line.strip()}
+
+    if args.source.startswith('s3://'):
+        bucket, _, prefix = args.source[len('s3://'):].partition('/')
+        s3 = boto3.session.Session().client(
+            service_name='s3',
+            endpoint_url=args.endpoint_url,
+            aws_access_key_id=os.getenv('ACCESS_KEY'),
+            aws_secret_access_key=os.getenv('SECRET_KEY'),
+            config=Config(max_pool_connections=args.workers)
+        )
+        keys = list_s3(s3, bucket, prefix)
+
+        def load(key):
+            return decode_image(s3.get_object(Bucket=bucket, Key=key)['Body'].read())
+    else:
+        keys = list_local(args.source)
+
+        def load(key):
+            with open(key, 'rb') as f:
+                return decode_image(f.read())
+
+    processor = MedicalImageProcessor.from_models_dir(
+        args.models_dir,
+        device=torch.device('cuda' if torch.cuda.is_available() else 'cpu'),
+        backend=args.backend,
+        num_threads=args.num_threads,
+        quantized=args.quantized,
+        max_rois=args.max_rois
+    )
+    model_version = processor.model_version
+    compute_heatmaps = args.heatmaps_dir is not None
+
+    def score(batch):
+        """
+        Пары (источник, результат). Если пакет падает целиком (например, кадр с неподдерживаемым числом каналов),
+        изображения повторяются по одному, сбойные получают строку с ошибкой и тоже попадают в контрольную точку.
+        """
+        try:
+            results = processor.process_batch(batch, compute_heatmaps=compute_heatmaps, batch_size=args.batch_size)
+            return [(source, result) for (img, source), result in zip(batch, results)]
+        except Exception:
+            if len(batch) == 1:
+                raise
+        scored = []
+        for img, source in batch:
+            try:
+                scored.extend(score([(img, source)]))
+            except Exception as e:
+                scored.append((source, {"error": f'Cannot score image: {e}'}))
+        return scored
+
+    def flush(batch, failed):
+        rows = []
+        if batch:
+            for source, result in score(batch):
+                rows.extend(result_rows(result, source, model_version))
+                if compute_heatmaps:
+                    save_heatmaps(result, source, args.heatmaps_dir)
+        for source, e in failed:
+            rows.extend(result_rows({"error": f'Cannot read image: {e}'}, source, model_version))
+        if rows:
+            write_rows(rows, args.output, args.format)
+        with open(checkpoint, 'a') as f:
+            f.writelines(f'{source}\n' for img, source in batch)
+            f.writelines(f'{source}\n' for source, e in failed)
+
+    processed = len(done)
+    batch, failed = [], []
+    for key, future in prefetch((key for key in keys if key not in done), load, args.workers, args.prefetch):
+        try:
+            batch.append((future.result(), key))
+        except Exception as e:
+            failed.append((key, e))
+        if len(batch) + len(failed) >= args.batch_size:
+            flush(batch, failed)
+            processed += len(batch) + len(failed)
+            print(f'{processed} images scored')
+            batch, failed = [], []
+    flush(batch, failed)
+    processed += len(batch) + len(failed)
+    print(f'{processed} images scored, model version {model_version}')
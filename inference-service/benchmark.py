@@ -0,0 +1,169 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+from monai.networks.nets import densenet121
+from PIL import Image
+from ultralytics.nn.tasks import DetectionModel
+
+from spina_bifida import MODEL_FILES, MedicalImageProcessor, ModelRegistry, decode_image
+
+# Бенчмарк конвейера MedicalImageProcessor на моделях-заглушках со случайными весами (скачивание моделей не нужно).
+# Входы - встроенные примеры и синтетические кадры размера УЗИ. Для каждого бэкенда измеряются задержки
+# стадий (p50/p95), режимы целиком (process_image с тепловыми картами, score_image, process_batch) и пиковый RSS.
+# Каждый бэкенд измеряется в отдельном процессе, поэтому пиковый RSS относится только к нему.
+# Результат - JSON для сравнения между релизами.
+
+class StandInProcessor(MedicalImageProcessor):
+    """
+    Процессор на моделях-заглушках. YOLO выполняет полный проход, но рамки заменяются центральной
+    областью кадра: у случайных весов нет осмысленных детекций, а следующие стадии должны получить области интереса.
+    """
+    def detect_rois_batch(self, imgs, conf=0.1, max_rois=None):
+        super().detect_rois_batch(imgs, conf=conf, max_rois=max_rois)
+        detections = []
+        for k, img in enumerate(imgs):
+            width, height = img.size
+            detections.append([([width * 0.25, height * 0.25, width * 0.75, height * 0.75], 0.9, k % 2 + 1)])
+
+        return detections
+
+def make_stand_in_models(directory):
+    torch.manual_seed(0)
+    paths = {name: os.path.join(directory, file_name) for name, file_name in MODEL_FILES.items()}
+    # Чекпоинт в формате ultralytics: YOLO(path) загружает его так же, как обученный детектор
+    torch.save({'model': DetectionModel('yolov8n.yaml', nc=3, verbose=False).half(), 'train_args': {}}, paths['detector'])
+    for plane_name in ('axial', 'sagittal'):
+        for task in ('quality', 'pathology'):
+            model = densenet121(spatial_dims=2, in_channels=3, out_channels=2, pretrained=False)
+            torch.save(model.state_dict(), paths[f'{plane_name}_{task}'])
+
+    return ModelRegistry(paths)
+
+def synthetic_frames(count, size, seed=0):
+    # Спекл-шум с затемненными краями: по размеру и статистике яркости близко к кадру УЗИ
+    rng = np.random.default_rng(seed)
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width]
+    vignette = 1 - np.hypot((x - width / 2) / width, (y - height / 2) / height)
+    frames = []
+    for i in range(count):
+        gray = np.clip(rng.rayleigh(60, (height, width)) * vignette, 0, 255).astype(np.uint8)
+        frames.append(Image.fromarray(np.stack([gray] * 3, axis=-1)))
+
+    return frames
+
+def measure(fn, items, repeat, warmup=1):
+    for item in items[:warmup]:
+        fn(item)
+    times = []
+    for i in range(repeat):
+        for item in items:
+            start = time.perf_counter()
+            fn(item)
+            times.append(time.perf_counter() - start)
+    p50, p95 = np.percentile(times, [50, 95]) * 1000
+
+    return {"calls": len(times), "p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3), "mean_ms": round(float(np.mean(times)) * 1000, 3)}
+
+def peak_rss_mb():
+    # ru_maxrss в Linux - в килобайтах; пик за все время процесса (отдельного для каждого бэкенда, см. run_backend_isolated)
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def run_backend_isolated(backend, models_dir, frames, batch_sizes, repeat, num_threads=None):
+    """
+    run_backend в новом процессе (spawn): пиковый RSS и загруженные модели не смешиваются между бэкендами.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(_run_backend_child, backend, models_dir, frames, batch_sizes, repeat, num_threads).result()
+
+def _run_backend_child(backend, models_dir, frames, batch_sizes, repeat, num_threads):
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    return run_backend(backend, ModelRegistry.from_dir(models_dir), frames, batch_sizes, repeat)
+
+def run_backend(backend, registry, frames, batch_sizes, repeat):
+    processor = StandInProcessor(registry, device=torch.device('cpu'), backend=backend, max_rois=1)
+    names = [f'frame_{i}' for i in range(len(frames))]
+    crops = [processor._crop_image(frame, processor.detect_rois_batch([frame])[0][0][0]) for frame in frames]
+    tensors = [processor.preprocess([crop]) for crop in crops]
+    model = processor.get_model('axial', 'quality')
+    scorer = processor.get_scorer('axial', 'quality')
+    cams = [processor.get_prediction_and_cam(tensor, model)[1][0] for tensor in tensors]
+
+    stages = {}
+    with torch.inference_mode():
+        stages["object_detection"] = measure(lambda frame: processor.detect_rois_batch([frame]), frames, repeat)
+        stages["preprocess"] = measure(lambda crop: processor.preprocess([crop]), crops, repeat)
+        stages["get_prediction"] = measure(lambda tensor: scorer(tensor), tensors, repeat)
+    stages["get_prediction_and_cam"] = measure(lambda tensor: processor.get_prediction_and_cam(tensor, model), tensors, repeat)
+    stages["get_heatmap"] = measure(lambda k: processor.get_heatmap(tensors[k], cams[k], crops[k].size), list(range(len(tensors))), repeat)
+
+    modes = {
+        "eager": measure(lambda k: processor.process_image(frames[k], names[k]), list(range(len(frames))), repeat),
+        "score_only": measure(lambda k: processor.score_image(frames[k], names[k]), list(range(len(frames))), repeat),
+    }
+    for batch_size in batch_sizes:
+        batch = [(frames[i % len(frames)], names[i % len(frames)]) for i in range(batch_size)]
+        timing = measure(lambda batch: processor.process_batch(batch, compute_heatmaps=False, batch_size=batch_size), [batch], repeat)
+        timing["batch_size"] = batch_size
+        timing["images_per_s"] = round(batch_size / (timing["mean_ms"] / 1000), 2)
+        modes[f"batched_{batch_size}"] = timing
+
+    return {"backend": backend, "stages": stages, "modes": modes, "peak_rss_mb": peak_rss_mb()}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the MedicalImageProcessor pipeline on random-weight stand-in models')
+    parser.add_argument('--images', default=os.path.join('..', 'user-app', 'example_images'))
+    parser.add_argument('--synthetic', type=int, default=4, help='Number of synthetic frames')
+    parser.add_argument('--frame-size', default='1024x768')
+    parser.add_argument('--backends', default='torch,onnx')
+    parser.add_argument('--batch-sizes', default='1,4,16')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--num-threads', type=int)
+    parser.add_argument('--output', help='JSON file (default: stdout)')
+    args = parser.parse_args()
+
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    frames = []
+    for path in sorted(glob.glob(os.path.join(args.images, '*.jpg')) + glob.glob(os.path.join(args.images, '*.png'))):
+        with open(path, 'rb') as f:
+            frames.append(decode_image(f.read()))
+    frames.extend(synthetic_frames(args.synthetic, tuple(int(x) for x in args.frame_size.split('x'))))
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+        },
+        "frames": len(frames),
+        "repeat": args.repeat,
+        "backends": []
+    }
+    backends = args.backends.split(',')
+    with tempfile.TemporaryDirectory() as directory:
+        registry = make_stand_in_models(directory)
+        if 'onnx' in backends:
+            StandInProcessor(registry, device=torch.device('cpu')).export_onnx()
+        for backend in backends:
+            report["backends"].append(run_backend_isolated(backend, directory, frames, [int(x) for x in args.batch_sizes.split(',')], args.repeat, args.num_threads))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
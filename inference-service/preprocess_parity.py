@@ -0,0 +1,55 @@
+import argparse
+import glob
+import os
+import sys
+
+import numpy as np
+import torch
+from monai.transforms import Compose, EnsureChannelFirst, EnsureType, Resize, ScaleIntensity
+
+from spina_bifida import MedicalImageProcessor, ModelRegistry, decode_image
+
+# Проверка совпадения MedicalImageProcessor.preprocess с прежней цепочкой MONAI
+# (PILToNumpy, EnsureChannelFirst, ScaleIntensity, Resize mode='area') на встроенных примерах.
+# Для каждого снимка сравниваются весь кадр и несколько областей разных пропорций; модели не загружаются.
+# Код возврата 1, если расхождение больше --tolerance.
+
+def reference_transform(input_size):
+    return Compose([
+        # PILToNumpy: оси изображения в порядке (x, y)
+        lambda img: np.array(img).transpose(1, 0, 2),
+        EnsureChannelFirst(channel_dim=-1),
+        ScaleIntensity(),
+        Resize(spatial_size=input_size, mode='area'),
+        EnsureType(),
+    ])
+
+def crops_of(img):
+    width, height = img.size
+    yield img
+    for x1, y1, x2, y2 in ((0.25, 0.25, 0.75, 0.75), (0.1, 0.3, 0.9, 0.6), (0.4, 0.05, 0.6, 0.95)):
+        yield img.crop((width * x1, height * y1, width * x2, height * y2))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the fused preprocess with the original MONAI transform chain')
+    parser.add_argument('--images', default=os.path.join('..', 'user-app', 'example_images'))
+    parser.add_argument('--tolerance', type=float, default=1e-4)
+    args = parser.parse_args()
+
+    # preprocess не обращается к моделям, поэтому чекпоинты в папке models не нужны
+    processor = MedicalImageProcessor(ModelRegistry.from_dir('models'), device=torch.device('cpu'))
+    transform = reference_transform(processor.input_size)
+    max_error = 0.0
+    paths = sorted(glob.glob(os.path.join(args.images, '*.jpg')) + glob.glob(os.path.join(args.images, '*.png')))
+    for path in paths:
+        with open(path, 'rb') as f:
+            img = decode_image(f.read()).convert('RGB')
+        for k, crop in enumerate(crops_of(img)):
+            expected = torch.as_tensor(transform(crop), dtype=torch.float32)
+            actual = processor.preprocess([crop])[0]
+            error = (expected - actual).abs().max().item()
+            max_error = max(max_error, error)
+            print(f'{path} crop {k} {crop.size}: max |fused - monai| = {error:.2e}')
+
+    print(f'{len(paths)} images, max error {max_error:.2e}, tolerance {args.tolerance:.0e}')
+    sys.exit(0 if paths and max_error <= args.tolerance else 1)
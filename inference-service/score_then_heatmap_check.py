@@ -0,0 +1,72 @@
+import argparse
+import glob
+import os
+import sys
+import tempfile
+
+import torch
+from monai.networks.nets import densenet121
+
+from spina_bifida import MODEL_FILES, BatchScheduler, MedicalImageProcessor, ModelRegistry, decode_image
+
+# Проверка порядка "сначала оценка, потом тепловые карты" (так работает user-app и сервис: /score, затем /heatmap):
+# классификаторы, впервые загруженные в режиме без тепловых карт, должны оставаться пригодными для Grad-CAM++.
+# Классификаторы - со случайными весами, детектор заменен центральной областью кадра (YOLO не загружается).
+# Код возврата 1 при ошибке любого из сценариев.
+
+class CenterRoiProcessor(MedicalImageProcessor):
+    def detect_rois_batch(self, imgs, conf=0.1, max_rois=None):
+        return [[([img.width * 0.25, img.height * 0.25, img.width * 0.75, img.height * 0.75], 0.9, k % 2 + 1)] for k, img in enumerate(imgs)]
+
+def make_processor(directory):
+    torch.manual_seed(0)
+    for name, file_name in MODEL_FILES.items():
+        path = os.path.join(directory, file_name)
+        if name == 'detector':
+            open(path, 'wb').close()
+        else:
+            torch.save(densenet121(spatial_dims=2, in_channels=3, out_channels=2, pretrained=False).state_dict(), path)
+    return CenterRoiProcessor(ModelRegistry.from_dir(directory), device=torch.device('cpu'))
+
+def score_then_process_image(directory, images):
+    processor = make_processor(directory)
+    for img, img_name in images:
+        processor.score_image(img, img_name)
+        result = processor.process_image(img, img_name)
+        assert result["quality"]["heatmap"] is not None
+
+def stream_then_roi_heatmaps(directory, images):
+    scheduler = BatchScheduler(make_processor(directory))
+    for result in list(scheduler.process_stream(images, compute_heatmaps=False)):
+        quality_heatmap, pathology_heatmap = scheduler.roi_heatmaps(result["cropped_img"], result["plane"]["plane"])
+        assert quality_heatmap.size == result["cropped_img"].size
+
+def upload_then_deferred_heatmaps(directory, files):
+    # Порядок user-app: байты загруженных файлов оцениваются потоком без тепловых карт,
+    # карты строятся позже (cache_heatmaps) по вырезанной области из результата оценки
+    scheduler = BatchScheduler(make_processor(directory))
+    for result in list(scheduler.process_stream(files, compute_heatmaps=False)):
+        assert result["quality"]["heatmap"] is None
+        scheduler.roi_heatmaps(result["cropped_img"], result["plane"]["plane"])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that heatmaps work after score-only inference')
+    parser.add_argument('--images', default=os.path.join('..', 'user-app', 'example_images'))
+    args = parser.parse_args()
+
+    files = []
+    for path in sorted(glob.glob(os.path.join(args.images, '*.jpg'))):
+        with open(path, 'rb') as f:
+            files.append((f.read(), path))
+    images = [(decode_image(data), path) for data, path in files]
+
+    failed = False
+    for check, inputs in ((score_then_process_image, (images,)), (stream_then_roi_heatmaps, (images,)), (upload_then_deferred_heatmaps, (files,))):
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                check(directory, *inputs)
+                print(f'{check.__name__}: ok')
+            except Exception as e:
+                failed = True
+                print(f'{check.__name__}: {type(e).__name__}: {e}')
+    sys.exit(1 if failed or not images else 0)
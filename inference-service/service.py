@@ -0,0 +1,187 @@
+import asyncio
+import base64
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import tornado.web
+from dotenv import load_dotenv
+
+from spina_bifida import RESULT_SCHEMA_VERSION, __version__, decode_image, enable_metrics_from_env, metrics, processor_from_env
+
+# Загрузка переменных окружения из .env файла
+load_dotenv()
+PORT = int(os.getenv('PORT') or 8000)
+# Число одновременно обрабатываемых HTTP-запросов. Модель все равно работает в одном потоке BatchScheduler,
+# поэтому воркеров должно быть не меньше, чем запросов, которые нужно объединять в один пакет
+WORKERS = int(os.getenv('WORKERS') or 8)
+QUEUE_SIZE = int(os.getenv('QUEUE_SIZE') or 64)
+BATCH_SIZE = int(os.getenv('BATCH_SIZE') or 16)
+
+###########
+# Функции #
+###########
+
+def encode_image(img):
+    if img is None:
+        return None
+    with metrics.time('png_encode'):
+        buffer = io.BytesIO()
+        img.save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+def serialize_roi(roi):
+    return {
+        "cropped_img": encode_image(roi["cropped_img"]),
+        "plane": {
+            "box": [float(x) for x in roi["plane"]["box"]],
+            "prediction_prob": float(roi["plane"]["prediction_prob"]),
+            "plane": roi["plane"]["plane"]
+        },
+        "quality": {"prediction_prob": float(roi["quality"]["prediction_prob"]), "heatmap": encode_image(roi["quality"]["heatmap"])},
+        "pathology": {"prediction_prob": float(roi["pathology"]["prediction_prob"]), "heatmap": encode_image(roi["pathology"]["heatmap"])}
+    }
+
+# Результат MedicalImageProcessor в JSON: изображения в base64 PNG, числа numpy в float.
+# Все области интереса передаются в "rois", первая из них - основная
+def serialize_result(result):
+    if "error" in result:
+        return result
+    return {
+        "img_name": result["img_name"],
+        "rois": [serialize_roi(roi) for roi in result["rois"]]
+    }
+
+class InferenceQueue:
+    """
+    Ограниченная очередь запросов к модели: workers задач забирают запросы и выполняют их в пуле потоков.
+    При переполнении очереди запрос сразу отклоняется (asyncio.QueueFull).
+    Запрос - функция с аргументами (по умолчанию _run - обработка списка изображений).
+    """
+    def __init__(self, processor, workers, maxsize):
+        self.processor = processor
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.tasks = []
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._worker()) for i in range(self.workers)]
+
+    async def submit(self, images, compute_heatmaps):
+        return await self.submit_call(self._run, images, compute_heatmaps)
+
+    async def submit_call(self, fn, *args):
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((fn, args, future))
+        return await future
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            fn, args, future = await self.queue.get()
+            try:
+                results = await loop.run_in_executor(self.executor, fn, *args)
+                if not future.done():
+                    future.set_result(results)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.queue.task_done()
+
+    def _run(self, images, compute_heatmaps):
+        results = self.processor.process_batch(images, compute_heatmaps=compute_heatmaps, batch_size=BATCH_SIZE)
+        return [serialize_result(result) for result in results]
+
+    def run_roi_heatmaps(self, data, plane):
+        quality_heatmap, pathology_heatmap = self.processor.roi_heatmaps(decode_image(data), plane)
+        return {"quality": encode_image(quality_heatmap), "pathology": encode_image(pathology_heatmap)}
+
+############
+# Запросы  #
+############
+
+class BaseHandler(tornado.web.RequestHandler):
+    def initialize(self, queue):
+        self.queue = queue
+
+    @staticmethod
+    def decode_image(item):
+        return base64.b64decode(item["data"]), item["name"]
+
+    async def run(self, images, compute_heatmaps):
+        return await self.run_call(self.queue.submit, images, compute_heatmaps)
+
+    async def run_call(self, submit, *args):
+        try:
+            return await submit(*args)
+        except asyncio.QueueFull:
+            raise tornado.web.HTTPError(503, reason='Inference queue is full')
+
+# POST /score: {"name": ..., "data": <base64>} -> вероятности без тепловых карт
+class ScoreHandler(BaseHandler):
+    compute_heatmaps = False
+
+    async def post(self):
+        body = json.loads(self.request.body)
+        results = await self.run([self.decode_image(body)], self.compute_heatmaps)
+        self.write(results[0])
+
+# POST /heatmap: то же, что /score, плюс тепловые карты Grad-CAM++
+class HeatmapHandler(ScoreHandler):
+    compute_heatmaps = True
+
+# POST /batch: {"images": [{"name": ..., "data": <base64>}, ...], "heatmaps": false} -> {"results": [...]}
+class BatchHandler(BaseHandler):
+    async def post(self):
+        body = json.loads(self.request.body)
+        images = [self.decode_image(item) for item in body["images"]]
+        results = await self.run(images, bool(body.get("heatmaps", False)))
+        self.write({"results": results})
+
+# POST /roi_heatmap: {"name": ..., "data": <base64 вырезанной области>, "plane": 1|2} -> {"quality": <base64>, "pathology": <base64>}
+# Тепловые карты области интереса, найденной ранее в /score: детекция не повторяется
+class RoiHeatmapHandler(BaseHandler):
+    async def post(self):
+        body = json.loads(self.request.body)
+        data = self.decode_image(body)[0]
+        self.write(await self.run_call(self.queue.submit_call, self.queue.run_roi_heatmaps, data, int(body["plane"])))
+
+# GET /health: состояние очереди, версии моделей, пакета и схемы результата
+class HealthHandler(BaseHandler):
+    def get(self):
+        self.write({
+            "queue_size": self.queue.queue.qsize(),
+            "queue_maxsize": self.queue.queue.maxsize,
+            "workers": self.queue.workers,
+            "model_version": self.queue.processor.model_version,
+            "package_version": __version__,
+            "schema_version": RESULT_SCHEMA_VERSION
+        })
+
+##########
+# Сервис #
+##########
+
+async def main():
+    enable_metrics_from_env()
+    # Запросы от разных воркеров объединяются в общие пакеты BatchScheduler, модель работает в одном потоке.
+    # INFERENCE_URL сервиса не учитывается: модели всегда загружаются в процессе
+    queue = InferenceQueue(processor_from_env('models', remote=False), WORKERS, QUEUE_SIZE)
+    queue.start()
+
+    handler_args = dict(queue=queue)
+    app = tornado.web.Application([
+        (r'/score', ScoreHandler, handler_args),
+        (r'/heatmap', HeatmapHandler, handler_args),
+        (r'/batch', BatchHandler, handler_args),
+        (r'/roi_heatmap', RoiHeatmapHandler, handler_args),
+        (r'/health', HealthHandler, handler_args),
+    ])
+    app.listen(PORT)
+    await asyncio.Event().wait()
+
+if __name__ == '__main__':
+    asyncio.run(main())
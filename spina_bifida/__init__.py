@@ -0,0 +1,54 @@
+"""
+Общий конвейер инференса для user-app, dataset-app и inference-service.
+
+Модули импортируются при первом обращении к имени: приложению, которому нужны только манифесты
+или клиент сервиса, не требуются torch, ultralytics и onnxruntime.
+"""
+import importlib
+
+__version__ = '1.0.0'
+
+_EXPORTS = {
+    'Metrics': 'telemetry',
+    'metrics': 'telemetry',
+    'COLORMAP_LUTS': 'images',
+    'make_colormap_lut': 'images',
+    'decode_image': 'images',
+    'RESULT_SCHEMA_VERSION': 'schema',
+    'SAGITTAL': 'schema',
+    'AXIAL': 'schema',
+    'PLANE_NAMES': 'schema',
+    'make_roi': 'schema',
+    'make_result': 'schema',
+    'make_error': 'schema',
+    'MODEL_FILES': 'registry',
+    'ModelRegistry': 'registry',
+    'MedicalImageProcessor': 'processor',
+    'OnnxClassifier': 'processor',
+    'onnx_model_path': 'processor',
+    'quantized_model_path': 'processor',
+    'ResultCache': 'cache',
+    'BatchScheduler': 'scheduler',
+    'InferenceClient': 'client',
+    'ExampleArtifact': 'examples',
+    'S3Uploader': 'storage',
+    'UploadQueue': 'storage',
+    'enable_metrics_from_env': 'env',
+    'processor_from_env': 'env',
+    'upload_queue_from_env': 'env',
+    'manifest_rows': 'manifest',
+    'manifest_bytes': 'manifest',
+    'read_manifest': 'manifest',
+}
+
+__all__ = ['__version__', *_EXPORTS]
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{_EXPORTS[name]}', __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted([*globals(), *_EXPORTS])
@@ -0,0 +1,114 @@
+import io
+import json
+import time
+import struct
+import sqlite3
+import hashlib
+import contextlib
+
+from PIL import Image
+
+class ResultCache:
+    """
+    Персистентный кэш результатов в SQLite, общий для процессов, реплик (при общем диске) и перезапусков.
+    Ключ - SHA-256 декодированных пикселей, версия моделей и ограничение числа областей интереса (max_rois). Хранятся рамки, плоскости и вероятности (JSON),
+    тепловые карты всех областей интереса - в сжатом виде (WebP). При превышении max_bytes вытесняются
+    давно не использованные записи.
+    """
+    # Версия формата записей: входит в ключ, чтобы записи старого формата не читались
+    format_version = 2
+
+    def __init__(self, path, max_bytes=512 * 1024 ** 2, image_format='WEBP'):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.image_format = image_format
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'key TEXT PRIMARY KEY, record TEXT NOT NULL, quality_heatmap BLOB, pathology_heatmap BLOB, '
+                'size INTEGER NOT NULL, accessed REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def make_key(self, img, model_version, max_rois=None):
+        # Процессы с разным max_rois, разделяющие кэш, не должны получать записи с усеченным списком областей
+        digest = hashlib.sha256(f'{img.mode}:{img.size}:'.encode())
+        digest.update(img.tobytes())
+        return f'{model_version}:{self.format_version}:{max_rois or "all"}:{digest.hexdigest()}'
+
+    def _encode_images(self, imgs):
+        # Несколько изображений в одном поле: каждое с префиксом длины
+        if imgs is None:
+            return None
+        data = []
+        for img in imgs:
+            buffer = io.BytesIO()
+            img.save(buffer, format=self.image_format, quality=90)
+            data.append(struct.pack('>I', buffer.tell()) + buffer.getvalue())
+        return b''.join(data)
+
+    @staticmethod
+    def _decode_images(data):
+        if data is None:
+            return None
+        imgs = []
+        offset = 0
+        while offset < len(data):
+            size, = struct.unpack_from('>I', data, offset)
+            offset += 4
+            imgs.append(Image.open(io.BytesIO(data[offset:offset + size])))
+            offset += size
+        return imgs
+
+    def get(self, key, with_heatmaps=False):
+        """
+        (запись, тепловые карты качества, тепловые карты патологии) или None, если записи нет
+        или в ней нет запрошенных тепловых карт.
+        """
+        with self._connect() as connection:
+            row = connection.execute('SELECT record, quality_heatmap, pathology_heatmap FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            record, quality_heatmap, pathology_heatmap = row
+            record = json.loads(record)
+            if with_heatmaps and "error" not in record and quality_heatmap is None:
+                return None
+            connection.execute('UPDATE results SET accessed = ? WHERE key = ?', (time.time(), key))
+
+        if not with_heatmaps:
+            return record, None, None
+        return record, self._decode_images(quality_heatmap), self._decode_images(pathology_heatmap)
+
+    def put(self, key, record, quality_heatmaps=None, pathology_heatmaps=None):
+        record = json.dumps(record)
+        quality_heatmap, pathology_heatmap = self._encode_images(quality_heatmaps), self._encode_images(pathology_heatmaps)
+        size = len(key) + len(record) + len(quality_heatmap or b'') + len(pathology_heatmap or b'')
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                (key, record, quality_heatmap, pathology_heatmap, size, time.time())
+            )
+            self._evict(connection)
+
+    def _evict(self, connection):
+        total, = connection.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+        stale = []
+        for key, size in connection.execute('SELECT key, size FROM results ORDER BY accessed'):
+            if excess <= 0:
+                break
+            stale.append((key,))
+            excess -= size
+        connection.executemany('DELETE FROM results WHERE key = ?', stale)
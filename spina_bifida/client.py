@@ -0,0 +1,90 @@
+import io
+import base64
+
+import requests
+from PIL import Image
+
+from .telemetry import metrics
+from .schema import make_error, make_result, make_roi
+
+class InferenceClient:
+    """
+    Тонкий клиент сервиса инференса (inference-service) с тем же интерфейсом, что у MedicalImageProcessor.
+    """
+    def __init__(self, url, timeout=300):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    @property
+    def model_version(self):
+        response = self.session.get(f'{self.url}/health', timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["model_version"]
+
+    def _post(self, endpoint, payload):
+        response = self.session.post(f'{self.url}/{endpoint}', json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    @staticmethod
+    def _encode_image(img, img_name):
+        # Сервису передаются байты файла; декодированное изображение кодируется в PNG
+        if isinstance(img, Image.Image):
+            with metrics.time('png_encode'):
+                buffer = io.BytesIO()
+                img.save(buffer, format='PNG')
+                img = buffer.getvalue()
+        return {"name": img_name, "data": base64.b64encode(img).decode('ascii')}
+
+    @staticmethod
+    def _decode_image(data):
+        if data is None:
+            return None
+        return Image.open(io.BytesIO(base64.b64decode(data)))
+
+    def _decode_roi(self, roi):
+        return make_roi(
+            self._decode_image(roi["cropped_img"]),
+            roi["plane"]["box"],
+            roi["plane"]["prediction_prob"],
+            roi["plane"]["plane"],
+            roi["quality"]["prediction_prob"],
+            roi["pathology"]["prediction_prob"],
+            self._decode_image(roi["quality"]["heatmap"]),
+            self._decode_image(roi["pathology"]["heatmap"])
+        )
+
+    def _decode_result(self, result):
+        if "error" in result:
+            return make_error(result["img_name"], result["error"])
+        return make_result(result["img_name"], [self._decode_roi(roi) for roi in result["rois"]])
+
+    def process_image(self, img, img_name, compute_heatmaps=True):
+        endpoint = 'heatmap' if compute_heatmaps else 'score'
+        return self._decode_result(self._post(endpoint, self._encode_image(img, img_name)))
+
+    def score_image(self, img, img_name):
+        return self.process_image(img, img_name, compute_heatmaps=False)
+
+    def roi_heatmaps(self, cropped_img, plane):
+        payload = {**self._encode_image(cropped_img, 'roi'), "plane": int(plane)}
+        result = self._post('roi_heatmap', payload)
+        return self._decode_image(result["quality"]), self._decode_image(result["pathology"])
+
+    def process_batch(self, images, compute_heatmaps=True, batch_size=16):
+        results = []
+        for start in range(0, len(images), batch_size):
+            payload = {
+                "images": [self._encode_image(img, img_name) for img, img_name in images[start:start + batch_size]],
+                "heatmaps": compute_heatmaps
+            }
+            results.extend(self._decode_result(result) for result in self._post('batch', payload)["results"])
+
+        return results
+
+    def process_stream(self, images, compute_heatmaps=True, batch_size=16):
+        # Декодирование и пакетирование выполняет сервис, результаты выдаются по мере ответов на пакеты
+        images = list(images)
+        for start in range(0, len(images), batch_size):
+            yield from self.process_batch(images[start:start + batch_size], compute_heatmaps, batch_size)
@@ -0,0 +1,66 @@
+"""
+Сборка конвейера по переменным окружения (.env приложений и сервиса инференса).
+
+Переменные: INFERENCE_URL, INFERENCE_BACKEND, NUM_THREADS, QUANTIZED, BATCH_SIZE, BATCH_WAIT_MS,
+RESULT_CACHE_PATH, RESULT_CACHE_MAX_MB, MAX_ROIS, METRICS_PORT, BUCKET, ACCESS_KEY, SECRET_KEY,
+UPLOAD_WORKERS, UPLOAD_QUEUE_PATH. Зависимости модулей импортируются только в нужной ветке:
+с INFERENCE_URL не загружаются torch и ultralytics.
+"""
+import os
+
+from .telemetry import metrics
+
+def env_int(name, default=0):
+    return int(os.getenv(name) or default)
+
+def env_flag(name):
+    return (os.getenv(name) or '').lower() in ('1', 'true')
+
+def enable_metrics_from_env():
+    # Экспортер Prometheus на METRICS_PORT; повторные вызовы ничего не делают
+    port = env_int('METRICS_PORT') or None
+    if port:
+        metrics.enable(port)
+
+def processor_from_env(models_dir='models', default_max_rois=0, remote=True):
+    """
+    Общий процессор: BatchScheduler над MedicalImageProcessor (с ResultCache, если задан RESULT_CACHE_PATH).
+    При remote=True и заданном INFERENCE_URL возвращается InferenceClient, модели не загружаются.
+    """
+    url = os.getenv('INFERENCE_URL')
+    if remote and url:
+        from .client import InferenceClient
+        return InferenceClient(url)
+
+    import torch
+    from .cache import ResultCache
+    from .processor import MedicalImageProcessor
+    from .scheduler import BatchScheduler
+
+    cache_path = os.getenv('RESULT_CACHE_PATH')
+    processor = MedicalImageProcessor.from_models_dir(
+        models_dir,
+        device=torch.device('cuda' if torch.cuda.is_available() else 'cpu'),
+        backend=os.getenv('INFERENCE_BACKEND') or 'torch',
+        num_threads=env_int('NUM_THREADS') or None,
+        quantized=env_flag('QUANTIZED'),
+        cache=ResultCache(cache_path, max_bytes=env_int('RESULT_CACHE_MAX_MB', 512) * 1024 ** 2) if cache_path else None,
+        max_rois=env_int('MAX_ROIS', default_max_rois) or None
+    )
+    # Запросы из разных потоков объединяются в общие пакеты, модель работает в одном потоке
+    return BatchScheduler(processor, max_wait_ms=float(os.getenv('BATCH_WAIT_MS') or 15), max_batch_size=env_int('BATCH_SIZE', 16))
+
+def upload_queue_from_env(default_workers=8):
+    """
+    Очередь загрузок в Object Storage: один клиент S3, пул из UPLOAD_WORKERS потоков.
+    """
+    from .storage import S3Uploader, UploadQueue
+
+    workers = env_int('UPLOAD_WORKERS', default_workers)
+    uploader = S3Uploader(
+        bucket=os.getenv('BUCKET'),
+        access_key=os.getenv('ACCESS_KEY'),
+        secret_key=os.getenv('SECRET_KEY'),
+        max_workers=workers
+    )
+    return UploadQueue(os.getenv('UPLOAD_QUEUE_PATH') or 'upload_queue.sqlite3', uploader, batch_size=workers)
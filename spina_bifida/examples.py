@@ -0,0 +1,112 @@
+import io
+import json
+import zipfile
+import hashlib
+
+from PIL import Image
+
+from .images import decode_image
+from .schema import make_error, make_result, make_roi
+
+class ExampleArtifact:
+    """
+    Предрассчитанные результаты (с тепловыми картами) для встроенных примеров: zip с manifest.json
+    и PNG-изображениями, собирается командой build_examples.py приложения user-app.
+    Результаты ищутся по SHA-256 байтов файла; в манифесте записаны версия формата и model_version,
+    приложение использует артефакт, только если он собран текущими моделями.
+    """
+    format_version = 2
+
+    def __init__(self, model_version, examples):
+        self.model_version = model_version
+        # SHA-256 файла -> {"error"} или {"rois": [{"box", "plane", "plane_prob", "quality", "pathology", "images": {...}}, ...]}
+        self.examples = examples
+
+    @staticmethod
+    def file_key(data):
+        return hashlib.sha256(data).hexdigest()
+
+    @classmethod
+    def build(cls, processor, files):
+        """
+        Обработка примеров processor с тепловыми картами, files - список пар (байты файла, имя).
+        """
+        results = processor.process_batch([(decode_image(data), img_name) for data, img_name in files])
+        examples = {}
+        for (data, img_name), result in zip(files, results):
+            if "error" in result:
+                examples[cls.file_key(data)] = {"error": result["error"]}
+                continue
+            examples[cls.file_key(data)] = {"rois": [{
+                "box": [float(x) for x in roi["plane"]["box"]],
+                "plane": roi["plane"]["plane"],
+                "plane_prob": float(roi["plane"]["prediction_prob"]),
+                "quality": float(roi["quality"]["prediction_prob"]),
+                "pathology": float(roi["pathology"]["prediction_prob"]),
+                "images": {"cropped_img": roi["cropped_img"], "quality": roi["quality"]["heatmap"], "pathology": roi["pathology"]["heatmap"]}
+            } for roi in result["rois"]]}
+
+        return cls(processor.model_version, examples)
+
+    def save(self, path):
+        manifest = {"format_version": self.format_version, "model_version": self.model_version, "examples": {}}
+        with zipfile.ZipFile(path, 'w') as archive:
+            for key, example in self.examples.items():
+                if "error" in example:
+                    manifest["examples"][key] = example
+                    continue
+                rois = []
+                for j, roi in enumerate(example["rois"]):
+                    images = {}
+                    for name, img in roi["images"].items():
+                        buffer = io.BytesIO()
+                        img.save(buffer, format='PNG')
+                        images[name] = f'{key}/{j}_{name}.png'
+                        archive.writestr(images[name], buffer.getvalue())
+                    rois.append({**{k: v for k, v in roi.items() if k != "images"}, "images": images})
+                manifest["examples"][key] = {"rois": rois}
+            archive.writestr('manifest.json', json.dumps(manifest))
+
+    @classmethod
+    def load(cls, path):
+        with zipfile.ZipFile(path) as archive:
+            manifest = json.loads(archive.read('manifest.json'))
+            if manifest["format_version"] != cls.format_version:
+                raise ValueError(f'Unsupported example artifact format: {manifest["format_version"]}')
+            examples = {}
+            for key, example in manifest["examples"].items():
+                if "error" in example:
+                    examples[key] = example
+                    continue
+                rois = []
+                for roi in example["rois"]:
+                    images = {}
+                    for name, member in roi["images"].items():
+                        images[name] = Image.open(io.BytesIO(archive.read(member)))
+                        images[name].load()
+                    rois.append({**roi, "images": images})
+                examples[key] = {"rois": rois}
+
+        return cls(manifest["model_version"], examples)
+
+    def get(self, key, img_name):
+        """
+        Результат в формате MedicalImageProcessor.process_image или None, если примера нет в артефакте.
+        """
+        example = self.examples.get(key)
+        if example is None:
+            return None
+        if "error" in example:
+            return make_error(img_name, example["error"])
+        rois = [make_roi(
+            roi["images"]["cropped_img"],
+            roi["box"],
+            roi["plane_prob"],
+            roi["plane"],
+            roi["quality"],
+            roi["pathology"],
+            roi["images"]["quality"],
+            roi["images"]["pathology"]
+        ) for roi in example["rois"]]
+
+        return make_result(img_name, rois)
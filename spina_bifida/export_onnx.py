@@ -0,0 +1,28 @@
+import argparse
+import glob
+import os
+
+import torch
+
+from .processor import MedicalImageProcessor
+
+# Экспорт детектора и классификаторов из models/*.pt в ONNX для бэкенда INFERENCE_BACKEND=onnx
+# С флагом --quantize дополнительно собираются INT8-классификаторы (QUANTIZED=1)
+# Запуск из папки приложения: python -m spina_bifida.export_onnx
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export models/*.pt to ONNX')
+    parser.add_argument('--models-dir', default='models')
+    parser.add_argument('--opset', type=int, default=17)
+    parser.add_argument('--quantize', action='store_true', help='Build INT8 classifiers calibrated on --calibration-dir')
+    parser.add_argument('--calibration-dir', default='example_images')
+    parser.add_argument('--tolerance', type=float, default=0.05, help='Max allowed INT8 vs FP32 probability difference')
+    args = parser.parse_args()
+
+    processor = MedicalImageProcessor.from_models_dir(args.models_dir, device=torch.device('cpu'))
+    for path in processor.export_onnx(opset_version=args.opset):
+        print(path)
+
+    if args.quantize:
+        calibration_images = sorted(glob.glob(os.path.join(args.calibration_dir, '*.jpg')) + glob.glob(os.path.join(args.calibration_dir, '*.png')))
+        for path, error in processor.quantize_onnx(calibration_images, tolerance=args.tolerance).items():
+            print(f'{path}: max |int8 - fp32| = {error:.4f}')
@@ -0,0 +1,39 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+def make_colormap_lut(colors, n=256):
+    """
+    Таблица цветов uint8 (n, 3) линейной палитры по равноотстоящим опорным цветам,
+    как LinearSegmentedColormap.from_list в matplotlib.
+    """
+    anchors = np.array([[(c >> 16) & 255, (c >> 8) & 255, c & 255] for c in colors], dtype=np.float64) / 255
+    x = np.linspace(0, 1, n)
+    xp = np.linspace(0, 1, len(colors))
+    lut = np.stack([np.interp(x, xp, anchors[:, channel]) for channel in range(3)], axis=-1)
+    return (lut * 255).astype(np.uint8)
+
+# Палитры тепловых карт считаются один раз при импорте (опорные цвета RdBu из ColorBrewer, как в matplotlib)
+COLORMAP_LUTS = {
+    'RdBu': make_colormap_lut([0x67001f, 0xb2182b, 0xd6604d, 0xf4a582, 0xfddbc7, 0xf7f7f7, 0xd1e5f0, 0x92c5de, 0x4393c3, 0x2166ac, 0x053061]),
+}
+
+def normalize_maps(maps):
+    # Min-max нормировка каждой карты пакета (N, H, W) в [0, 1]; постоянная карта становится нулевой
+    maps = maps - maps.min(axis=(1, 2), keepdims=True)
+    peak = maps.max(axis=(1, 2), keepdims=True)
+    return np.divide(maps, peak, out=np.zeros_like(maps), where=peak > 0)
+
+def decode_image(data, max_size=None):
+    """
+    Однократное декодирование изображения из байтов файла.
+    Для JPEG при заданном max_size используется уменьшенное декодирование (draft)
+    до ближайшего масштаба, не меньшего max_size; координаты рамок тогда относятся к уменьшенному изображению.
+    """
+    img = Image.open(io.BytesIO(data))
+    if max_size and img.format == 'JPEG':
+        img.draft(img.mode, (max_size, max_size))
+    # Декодируем сразу: изображение потом читается из нескольких потоков
+    img.load()
+    return img
@@ -0,0 +1,56 @@
+import io
+import json
+
+def manifest_rows(annotation, data_object, submission_id, model_version=None):
+    """
+    Плоские строки манифеста партии из аннотации изображения (в формате annotation/*.json):
+    по строке на каждую область интереса или одна строка с ошибкой.
+    """
+    rows = []
+    for roi_index, roi in enumerate(annotation.get('rois') or [None]):
+        roi = roi or {}
+        box = roi.get('box', {})
+        rows.append({
+            'submission_id': submission_id,
+            'data_object': data_object,
+            'img': annotation['img'],
+            'old_file_name': annotation['old_file_name'],
+            'org_id': annotation['org_id'],
+            'roi_index': roi_index if roi else None,
+            'quality': roi.get('quality'),
+            'pathology': roi.get('pathology'),
+            'plane': roi.get('plane'),
+            'roi_prediction': roi.get('prediction'),
+            'x1': box.get('x1'),
+            'y1': box.get('y1'),
+            'x2': box.get('x2'),
+            'y2': box.get('y2'),
+            'model_version': model_version,
+            'error': annotation.get('error'),
+        })
+
+    return rows
+
+def manifest_bytes(rows, fmt='jsonl'):
+    """
+    Манифест партии: JSONL (одна строка на область интереса, см. manifest_rows) или Parquet.
+    """
+    if fmt == 'jsonl':
+        return ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows).encode()
+    if fmt == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        buffer = io.BytesIO()
+        pq.write_table(pa.Table.from_pylist(rows), buffer)
+        return buffer.getvalue()
+    raise ValueError(f"Unknown manifest format: {fmt}")
+
+def read_manifest(data, fmt):
+    if fmt == 'jsonl':
+        return [json.loads(line) for line in data.decode().splitlines() if line]
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+
+        return pq.read_table(io.BytesIO(data)).to_pylist()
+    raise ValueError(f"Unknown manifest format: {fmt}")
@@ -0,0 +1,599 @@
+import os
+import hashlib
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from monai.networks.nets import densenet121
+from monai.visualize import default_normalizer, default_upsampler
+from PIL import Image
+
+from .images import COLORMAP_LUTS, decode_image, normalize_maps
+from .telemetry import metrics
+from .registry import ModelRegistry, file_checksum
+from .schema import AXIAL, make_error, make_result, make_roi
+
+def onnx_model_path(path):
+    """
+    Путь к ONNX-версии модели: рядом с чекпоинтом .pt, с расширением .onnx.
+    """
+    return os.path.splitext(path)[0] + '.onnx'
+
+def quantized_model_path(path):
+    """
+    Путь к INT8-версии ONNX-модели.
+    """
+    return os.path.splitext(path)[0] + '.int8.onnx'
+
+class OnnxClassifier:
+    """
+    Классификатор, экспортированный в ONNX, на onnxruntime (CPU).
+    Вызывается как модель PyTorch и возвращает логиты в виде torch.Tensor.
+    """
+    def __init__(self, path, num_threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.inter_op_num_threads = 1
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x):
+        inputs = np.ascontiguousarray(x.detach().cpu().numpy(), dtype=np.float32)
+        logits = self.session.run(None, {self.input_name: inputs})[0]
+        return torch.from_numpy(logits)
+
+class MedicalImageProcessor:
+    """
+    """
+    def __init__(self, registry, device, backend='torch', num_threads=None, quantized=False, cache=None, max_rois=None):
+        # Чекпоинты берутся из реестра моделей (ModelRegistry)
+        self.registry = registry
+        self.device = device
+        # Бэкенд для детекции и оценки вероятностей: 'torch' или 'onnx' (onnxruntime, CPU).
+        # Grad-CAM++ всегда считается на PyTorch
+        if backend not in ('torch', 'onnx'):
+            raise ValueError(f"Unknown backend: {backend}")
+        self.backend = backend
+        self.num_threads = num_threads
+        # INT8-классификаторы (см. quantize_onnx) доступны только в бэкенде 'onnx'
+        if quantized and backend != 'onnx':
+            raise ValueError("Quantized classifiers require backend='onnx'")
+        self.quantized = quantized
+        # Максимальное число областей интереса на кадр (None - все найденные)
+        self.max_rois = max_rois
+        # Персистентный кэш результатов (ResultCache), необязательный
+        self.cache = cache
+        self._model_version = None
+        # Модели загружаются лениво, при первом обращении к нужной плоскости/задаче
+        self.yolo_model_path = registry.detector_path
+        self.model_paths = {
+            (plane_name, task): registry.classifier_path(plane_name, task)
+            for plane_name in ('axial', 'sagittal') for task in ('quality', 'pathology')
+        }
+        self._yolo_model = None
+        self._models = {}
+        self._lock = threading.Lock()
+        self.input_size = (255, 255)
+        self.target_layer = 'class_layers.relu'
+
+    @classmethod
+    def from_models_dir(cls, models_dir, device, **kwargs):
+        """
+        Процессор для стандартной папки моделей; чекпоинты сверяются с registry.json, если он есть.
+        """
+        registry = ModelRegistry.from_dir(models_dir)
+        registry.verify()
+        return cls(registry, device, **kwargs)
+
+    @staticmethod
+    def _crop_image(original_img, roi_bounding_box):
+        return original_img.crop(roi_bounding_box)
+
+    def preprocess(self, crops):
+        """
+        Вход классификаторов для списка вырезанных областей (PIL) одним проходом на каждую:
+        (N, C, *input_size) float32 на self.device.
+        Совпадает с прежней цепочкой MONAI (PILToNumpy с транспонированием, EnsureChannelFirst,
+        ScaleIntensity, Resize mode='area'): оси изображения идут в порядке (x, y), как при обучении.
+        Масштабирование яркости линейно и перестановочно с усреднением по площади,
+        поэтому выполняется после уменьшения по min/max исходной области.
+        Области не в режиме RGB (L, RGBA, P и т.д.) сначала переводятся в RGB: классификаторы принимают 3 канала,
+        а прежняя цепочка на таких областях завершалась ошибкой. Совпадение с цепочкой MONAI
+        проверяет inference-service/preprocess_parity.py.
+        """
+        with metrics.time('preprocess'):
+            return self._preprocess(crops)
+
+    def _preprocess(self, crops):
+        batch = torch.empty((len(crops), 3, *self.input_size), dtype=torch.float32, device=self.device)
+        for k, crop in enumerate(crops):
+            if crop.mode != 'RGB':
+                crop = crop.convert('RGB')
+            # np.asarray дает массив PIL только для чтения, torch.from_numpy над ним предупреждает: нужна записываемая копия
+            array = np.array(crop)
+            tensor = torch.from_numpy(array).to(self.device).permute(2, 1, 0).unsqueeze(0).float()
+            pooled = F.interpolate(tensor, size=self.input_size, mode='area')[0]
+            lo, hi = float(array.min()), float(array.max())
+            if hi > lo:
+                torch.mul(pooled.sub_(lo), 1.0 / (hi - lo), out=batch[k])
+            else:
+                batch[k].zero_()
+
+        return batch
+
+    def _load_model(self, path):
+        """
+        Классификатор с весами, отображенными в память прямо из чекпоинта (mmap=True, assign=True).
+        Модель создается на устройстве meta, поэтому случайная инициализация не выделяет память,
+        а параметры становятся тензорами над файлом: на CPU все процессы хоста (воркеры Streamlit, сервис)
+        используют одни и те же физические страницы из page cache, в памяти процесса остаются только активации.
+        Чекпоинты нужно обновлять заменой файла (новый файл и rename), а не перезаписью на месте.
+        Первая загрузка может произойти внутри inference_mode (оценка без тепловых карт); веса,
+        созданные в этом режиме, непригодны для Grad-CAM++, поэтому модель загружается с выключенным режимом.
+        """
+        with metrics.time_model_load(os.path.basename(path)), torch.inference_mode(False):
+            with torch.device('meta'):
+                model = densenet121(spatial_dims=2, in_channels=3, out_channels=2, pretrained=False)
+            model.load_state_dict(torch.load(path, map_location=self.device, weights_only=True, mmap=True), assign=True)
+            model.eval()
+        
+        return model
+
+    def _load_yolo_model(self):
+        from ultralytics import YOLO
+
+        with metrics.time_model_load(os.path.basename(self.yolo_model_path)):
+            if self.backend == 'onnx':
+                return YOLO(onnx_model_path(self.yolo_model_path), task='detect')
+            return YOLO(self.yolo_model_path).to(self.device)
+
+    @property
+    def yolo_model(self):
+        if self._yolo_model is None:
+            with self._lock:
+                if self._yolo_model is None:
+                    self._yolo_model = self._load_yolo_model()
+        return self._yolo_model
+
+    @property
+    def model_version(self):
+        """
+        Хэш отпечатка реестра моделей, настроек бэкенда и файлов ONNX, которыми считаются вероятности:
+        меняется при обновлении любой из моделей, в том числе при повторном экспорте или квантовании.
+        """
+        if self._model_version is None:
+            digest = hashlib.sha256(f'{self.backend}:{self.quantized}:{self.registry.fingerprint}'.encode())
+            if self.backend == 'onnx':
+                for path in self._onnx_paths():
+                    digest.update(f'{os.path.basename(path)}:{file_checksum(path)}\n'.encode())
+            self._model_version = digest.hexdigest()[:16]
+        return self._model_version
+
+    def _get_cached(self, key, loader):
+        if key not in self._models:
+            with self._lock:
+                if key not in self._models:
+                    self._models[key] = loader()
+        return self._models[key]
+
+    def get_model(self, plane_name, task):
+        """
+        Классификатор для плоскости ('axial'/'sagittal') и задачи ('quality'/'pathology'), загружается при первом обращении.
+        """
+        return self._get_cached((plane_name, task), lambda: self._load_model(self.model_paths[(plane_name, task)]))
+
+    def _load_onnx_classifier(self, path):
+        with metrics.time_model_load(os.path.basename(path)):
+            return OnnxClassifier(path, self.num_threads)
+
+    def _onnx_scorer_path(self, plane_name, task):
+        if self.quantized:
+            return quantized_model_path(self.model_paths[(plane_name, task)])
+        return onnx_model_path(self.model_paths[(plane_name, task)])
+
+    def _onnx_paths(self):
+        # Файлы, которые использует бэкенд 'onnx': детектор и классификаторы (FP32 или INT8)
+        return [onnx_model_path(self.yolo_model_path), *(self._onnx_scorer_path(plane_name, task) for plane_name, task in self.model_paths)]
+
+    def get_scorer(self, plane_name, task):
+        """
+        Модель для оценки вероятностей без тепловых карт в выбранном бэкенде.
+        """
+        if self.backend == 'onnx':
+            path = self._onnx_scorer_path(plane_name, task)
+            return self._get_cached((plane_name, task, path), lambda: self._load_onnx_classifier(path))
+        return self.get_model(plane_name, task)
+
+    def export_onnx(self, opset_version=17):
+        """
+        Экспорт детектора и четырех классификаторов в ONNX (файлы .onnx рядом с .pt).
+        """
+        from ultralytics import YOLO
+
+        exported = [YOLO(self.yolo_model_path).export(format='onnx', dynamic=True, opset=opset_version)]
+        dummy_input = torch.zeros(1, 3, *self.input_size, device=self.device)
+        for (plane_name, task), path in self.model_paths.items():
+            torch.onnx.export(
+                self.get_model(plane_name, task),
+                dummy_input,
+                onnx_model_path(path),
+                input_names=['input'],
+                output_names=['logits'],
+                dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}},
+                opset_version=opset_version,
+            )
+            exported.append(onnx_model_path(path))
+
+        return exported
+
+    @torch.inference_mode()
+    def _calibration_inputs(self, calibration_images):
+        """
+        Входы классификаторов для калибровки: вырезанные области интереса, сгруппированные по плоскости.
+        """
+        imgs = [Image.open(path) for path in calibration_images]
+        groups = {}
+        for img, (boxes, conf, plane) in zip(imgs, self.object_detection_batch(imgs)):
+            if boxes is not None:
+                groups.setdefault(self._plane_name(plane), []).append(self._crop_image(img, boxes))
+        if not groups:
+            raise ValueError("No objects detected in the calibration images.")
+
+        return {plane_name: self.preprocess(crops).cpu().numpy() for plane_name, crops in groups.items()}
+
+    def quantize_onnx(self, calibration_images, tolerance=0.05):
+        """
+        Статическая INT8-квантизация ONNX-классификаторов (onnxruntime, QDQ) с калибровкой на calibration_images.
+        Возвращает максимальное расхождение вероятностей INT8 и FP32 на калибровочных изображениях для каждой модели,
+        при расхождении больше tolerance выбрасывает ValueError и не изменяет существующие INT8-модели.
+        """
+        from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+        class CalibrationReader(CalibrationDataReader):
+            def __init__(self, inputs):
+                self.inputs = iter([{'input': x[np.newaxis]} for x in inputs])
+
+            def get_next(self):
+                return next(self.inputs, None)
+
+        calibration = self._calibration_inputs(calibration_images)
+        all_inputs = np.concatenate(list(calibration.values()))
+        # Модели пишутся во временные файлы и заменяют *.int8.onnx только если все прошли проверку:
+        # отклоненные модели не должны попасть в бэкенд с QUANTIZED=1
+        staged = {quantized_model_path(path): os.path.splitext(quantized_model_path(path))[0] + '.tmp.onnx' for path in self.model_paths.values()}
+        errors = {}
+        try:
+            for (plane_name, task), path in self.model_paths.items():
+                # Калибруем на кадрах своей плоскости, если они есть
+                inputs = calibration.get(plane_name, all_inputs)
+                staged_path = staged[quantized_model_path(path)]
+                quantize_static(
+                    onnx_model_path(path),
+                    staged_path,
+                    CalibrationReader(inputs),
+                    quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8,
+                    per_channel=True,
+                )
+                float_probs = torch.sigmoid(OnnxClassifier(onnx_model_path(path))(torch.from_numpy(inputs))[:, 1])
+                int8_probs = torch.sigmoid(OnnxClassifier(staged_path)(torch.from_numpy(inputs))[:, 1])
+                errors[quantized_model_path(path)] = (float_probs - int8_probs).abs().max().item()
+
+            failed = {path: error for path, error in errors.items() if error > tolerance}
+            if failed:
+                raise ValueError(f"Quantized models differ from float ones by more than {tolerance}: {failed}")
+            for path, staged_path in staged.items():
+                os.replace(staged_path, path)
+        finally:
+            for staged_path in staged.values():
+                if os.path.exists(staged_path):
+                    os.remove(staged_path)
+
+        return errors
+        
+    def object_detection(self, img, conf=0.1):
+        return self.object_detection_batch([img], conf=conf)[0]
+
+    def object_detection_batch(self, imgs, conf=0.1):
+        """
+        Детекция основной (наиболее уверенной) области интереса одним вызовом YOLO на список изображений.
+        """
+        # Возвращаем значения None, если объекты не обнаружены
+        return [rois[0] if rois else (None, None, None) for rois in self.detect_rois_batch(imgs, conf=conf, max_rois=1)]
+
+    def detect_rois_batch(self, imgs, conf=0.1, max_rois=None):
+        """
+        Все области интереса с уверенностью не ниже conf для каждого изображения, по убыванию уверенности.
+        NMS выполняется без учета класса, поэтому пересекающиеся рамки разных плоскостей не дублируются.
+        """
+        detections = []
+        with metrics.time('detection'):
+            for predictions in self.yolo_model.predict(imgs, verbose=False, conf=conf, agnostic_nms=True, max_det=max_rois or 300):
+                boxes = predictions.boxes.data.cpu().detach().numpy()[:max_rois]
+                detections.append([([x1, y1, x2, y2], box_conf, plane) for x1, y1, x2, y2, box_conf, plane in boxes])
+
+        return detections
+
+    @staticmethod
+    def _plane_name(plane):
+        return 'axial' if plane == AXIAL else 'sagittal'
+
+    def _get_models(self, plane_name, compute_heatmaps=True):
+        get = self.get_model if compute_heatmaps else self.get_scorer
+        return get(plane_name, 'quality'), get(plane_name, 'pathology')
+
+    @torch.inference_mode()
+    def get_prediction(self, cropped_img_tensor, model):
+
+        outputs = model(cropped_img_tensor)
+        prob = torch.sigmoid(outputs[0][1]).item()
+
+        return prob
+
+    def get_prediction_and_cam(self, cropped_img_tensor, model, compute_heatmap=True):
+        """
+        Один прямой проход модели: вероятность патологии/качества и, при необходимости, карта Grad-CAM++.
+        Активации целевого слоя снимаются хуком во время того же прохода, обратный проход
+        выполняется только если нужна тепловая карта.
+        Без тепловой карты model может быть любым вызываемым объектом, возвращающим логиты (например, OnnxClassifier).
+        """
+        if not compute_heatmap:
+            with metrics.time('classify'):
+                logits = model(cropped_img_tensor)
+            return torch.sigmoid(logits[:, 1]), None
+
+        activations = {}
+        thread_id = threading.get_ident()
+
+        def hook(module, inputs, output):
+            # Модель общая для потоков (сессии Streamlit, воркеры сервиса): берем активации только своего прохода
+            if threading.get_ident() == thread_id:
+                activations['acti'] = output
+
+        target_layer = model.get_submodule(self.target_layer)
+        handle = target_layer.register_forward_hook(hook)
+        try:
+            with metrics.time('classify'):
+                logits = model(cropped_img_tensor)
+        finally:
+            handle.remove()
+
+        probs = torch.sigmoid(logits[:, 1]).detach()
+        with metrics.time('grad_cam'):
+            cam = self._grad_cam_pp(cropped_img_tensor, logits, activations['acti'])
+        return probs, cam
+
+    @staticmethod
+    def _grad_cam_pp(cropped_img_tensor, logits, acti):
+        """
+        Grad-CAM++ по уже посчитанным логитам и активациям (повторяет monai.visualize.GradCAMpp).
+        """
+        class_idx = logits.max(1)[-1]
+        score = logits.gather(1, class_idx.unsqueeze(1)).squeeze(1)
+        grad, = torch.autograd.grad(score.sum(), acti)
+
+        with torch.no_grad():
+            acti = acti.detach()
+            b, c, *spatial = grad.shape
+            ones = [1] * len(spatial)
+            alpha_nr = grad.pow(2)
+            alpha_dr = alpha_nr.mul(2) + acti.mul(grad.pow(3)).view(b, c, -1).sum(-1).view(b, c, *ones)
+            alpha_dr = torch.where(alpha_dr != 0.0, alpha_dr, torch.ones_like(alpha_dr))
+            alpha = alpha_nr.div(alpha_dr + 1e-7)
+            relu_grad = F.relu(score.detach().exp().view(b, 1, *ones) * grad)
+            weights = (alpha * relu_grad).view(b, c, -1).sum(-1).view(b, c, *ones)
+            acti_map = F.relu((weights * acti).sum(1, keepdim=True))
+            acti_map = default_upsampler(cropped_img_tensor.shape[2:])(acti_map)
+
+        return default_normalizer(acti_map)
+
+    def get_heatmap(self, cropped_img_tensor, cam_image, size=None, cmap='RdBu', alpha=0.5):
+        return self.get_heatmaps(cropped_img_tensor[:1], cam_image[None], [size], cmap, alpha)[0]
+
+    def get_heatmaps(self, cropped_imgs_tensor, cams, sizes=None, cmap='RdBu', alpha=0.5):
+        """
+        Наложение карт Grad-CAM++ на входы модели для всего пакета: нормировка, палитра по таблице
+        COLORMAP_LUTS и смешивание выполняются одним проходом NumPy, в PIL остается только
+        масштабирование к размеру вырезанной области (sizes). Оси входа (x, y) переставляются,
+        поэтому изображения сразу ориентированы как исходный кадр.
+        """
+        with metrics.time('heatmap'):
+            return self._render_heatmaps(cropped_imgs_tensor, cams, sizes, cmap, alpha)
+
+    @staticmethod
+    def _render_heatmaps(cropped_imgs_tensor, cams, sizes, cmap, alpha):
+        images = normalize_maps(cropped_imgs_tensor[:, 0].detach().cpu().numpy())
+        cams = normalize_maps(cams[:, 0].detach().cpu().numpy())
+
+        lut = COLORMAP_LUTS[cmap]
+        cam_colored = lut[np.minimum((cams * len(lut)).astype(np.intp), len(lut) - 1)].astype(np.float32)
+        gray = (images * 255).astype(np.uint8).astype(np.float32)[..., None]
+        blended = (gray + alpha * (cam_colored - gray)).astype(np.uint8).transpose(0, 2, 1, 3)
+
+        heatmaps = []
+        for k, size in enumerate(sizes or [None] * len(blended)):
+            heatmap = Image.fromarray(np.ascontiguousarray(blended[k]), mode='RGB')
+            heatmaps.append(heatmap.resize(size) if size is not None else heatmap)
+
+        return heatmaps
+
+    @staticmethod
+    def _open_image(img):
+        # Уже декодированное изображение используется как есть, без повторного кодирования
+        if isinstance(img, Image.Image):
+            return img
+        with metrics.time('decode'):
+            return decode_image(img)
+
+    def process_image(self, img, img_name, compute_heatmaps=True):
+        return self.process_batch([(img, img_name)], compute_heatmaps=compute_heatmaps)[0]
+
+    def score_image(self, img, img_name):
+        """
+        Только вероятности (без Grad-CAM++ и отрисовки тепловых карт).
+        """
+        return self.process_image(img, img_name, compute_heatmaps=False)
+
+    def roi_heatmaps(self, cropped_img, plane):
+        """
+        Тепловые карты Grad-CAM++ (качество, патология) для области интереса, уже найденной в score_image:
+        cropped_img и plane берутся из его результата, поэтому детекция не повторяется.
+        """
+        quality_model, pathology_model = self._get_models(self._plane_name(plane))
+        cropped_img_tensor = self.preprocess([cropped_img])
+        _, quality_cam = self.get_prediction_and_cam(cropped_img_tensor, quality_model)
+        _, pathology_cam = self.get_prediction_and_cam(cropped_img_tensor, pathology_model)
+        sizes = [cropped_img.size]
+        return self.get_heatmaps(cropped_img_tensor, quality_cam, sizes)[0], self.get_heatmaps(cropped_img_tensor, pathology_cam, sizes)[0]
+
+    def process_batch(self, images, compute_heatmaps=True, batch_size=16):
+        """
+        Пакетная обработка списка пар (img, img_name), img - изображение PIL или байты файла.
+        YOLO запускается один раз на пакет, вырезанные области группируются по плоскости
+        и проходят через модели качества и патологии одним тензором.
+        Результаты возвращаются в порядке входного списка.
+        """
+        results = []
+        # Без тепловых карт граф вычислений не нужен: детекция и классификация идут в inference_mode
+        with torch.inference_mode(mode=not compute_heatmaps):
+            for start in range(0, len(images), batch_size):
+                results.extend(self._process_batch(images[start:start + batch_size], compute_heatmaps))
+
+        return results
+
+    def process_stream(self, images, compute_heatmaps=True, batch_size=16, workers=4):
+        """
+        Потоковая обработка итерируемого набора пар (img, img_name): декодирование идет в пуле потоков
+        с упреждением не более двух пакетов, пока модели обрабатывают текущий пакет.
+        Результаты выдаются по мере готовности пакетов, в порядке входа.
+        """
+        images = iter(images)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='decode') as executor:
+            pending = collections.deque()
+
+            def prefetch():
+                while len(pending) < 2 * batch_size:
+                    item = next(images, None)
+                    if item is None:
+                        return
+                    img, img_name = item
+                    pending.append((executor.submit(self._open_image, img), img_name))
+
+            prefetch()
+            while pending:
+                batch = []
+                while pending and len(batch) < batch_size:
+                    future, img_name = pending.popleft()
+                    batch.append((future.result(), img_name))
+                prefetch()
+                # Режим inference_mode включается на время пакета, а не на время жизни генератора
+                with torch.inference_mode(mode=not compute_heatmaps):
+                    results = self._process_batch(batch, compute_heatmaps)
+                yield from results
+
+    @staticmethod
+    def _make_roi(cropped_img, roi, quality_heatmap=None, pathology_heatmap=None):
+        return make_roi(cropped_img, roi["box"], roi["conf"], roi["plane"], roi["quality"], roi["pathology"], quality_heatmap, pathology_heatmap)
+
+    def _make_result(self, img_name, img, record, quality_heatmaps=None, pathology_heatmaps=None, cropped_imgs=None):
+        """
+        Результат обработки из записи {"rois": [{"box", "conf", "plane", "quality", "pathology"}, ...]} (или {"error"}).
+        Поля верхнего уровня относятся к основной (наиболее уверенной) области интереса, "rois" - ко всем найденным.
+        """
+        if "error" in record:
+            return make_error(img_name, record["error"])
+        rois = []
+        for j, roi in enumerate(record["rois"]):
+            cropped_img = cropped_imgs[j] if cropped_imgs is not None else self._crop_image(img, roi["box"])
+            rois.append(self._make_roi(
+                cropped_img,
+                roi,
+                quality_heatmaps[j] if quality_heatmaps is not None else None,
+                pathology_heatmaps[j] if pathology_heatmaps is not None else None
+            ))
+
+        return make_result(img_name, rois)
+
+    def _process_batch(self, images, compute_heatmaps):
+        img_names = [img_name for img, img_name in images]
+        imgs = [self._open_image(img) for img, img_name in images]
+        results = [None] * len(images)
+
+        # Кадры с тем же содержимым, уже обработанные этой версией моделей, берутся из кэша
+        cache_keys = [None] * len(images)
+        if self.cache is not None:
+            for i, img in enumerate(imgs):
+                cache_keys[i] = self.cache.make_key(img, self.model_version, self.max_rois)
+                cached = self.cache.get(cache_keys[i], compute_heatmaps)
+                if cached is not None:
+                    results[i] = self._make_result(img_names[i], img, *cached)
+
+        pending = [i for i in range(len(images)) if results[i] is None]
+        if self.cache is not None:
+            metrics.count('cache_hit', len(images) - len(pending))
+            metrics.count('cache_miss', len(pending))
+        if not pending:
+            return results
+        detections = dict(zip(pending, self.detect_rois_batch([imgs[i] for i in pending], max_rois=self.max_rois)))
+
+        # Все области интереса всех кадров пакета группируются по плоскости и классифицируются вместе
+        records = {}
+        heatmaps = {}
+        cropped_imgs = {}
+        groups = {}
+        for i in pending:
+            if not detections[i]:
+                metrics.count('roi_not_found')
+                records[i] = {"error": "No objects detected in the image."}
+                continue
+            n_rois = len(detections[i])
+            records[i] = {"rois": [None] * n_rois}
+            heatmaps[i] = ([None] * n_rois, [None] * n_rois)
+            cropped_imgs[i] = [None] * n_rois
+            for j, (boxes, conf, plane) in enumerate(detections[i]):
+                cropped_imgs[i][j] = self._crop_image(imgs[i], boxes)
+                groups.setdefault(self._plane_name(plane), []).append((i, j))
+
+        for plane_name, crops in groups.items():
+            quality_model, pathology_model = self._get_models(plane_name, compute_heatmaps)
+            cropped_imgs_tensor = self.preprocess([cropped_imgs[i][j] for i, j in crops])
+            quality_probs, quality_cams = self.get_prediction_and_cam(cropped_imgs_tensor, quality_model, compute_heatmaps)
+            pathology_probs, pathology_cams = self.get_prediction_and_cam(cropped_imgs_tensor, pathology_model, compute_heatmaps)
+
+            if compute_heatmaps:
+                sizes = [cropped_imgs[i][j].size for i, j in crops]
+                quality_maps = self.get_heatmaps(cropped_imgs_tensor, quality_cams, sizes)
+                pathology_maps = self.get_heatmaps(cropped_imgs_tensor, pathology_cams, sizes)
+
+            for k, (i, j) in enumerate(crops):
+                boxes, conf, plane = detections[i][j]
+
+                if compute_heatmaps:
+                    heatmaps[i][0][j] = quality_maps[k]
+                    heatmaps[i][1][j] = pathology_maps[k]
+
+                records[i]["rois"][j] = {
+                    "box": [float(x) for x in boxes],
+                    "conf": float(conf),
+                    "plane": int(plane),
+                    "quality": quality_probs[k].item(),
+                    "pathology": pathology_probs[k].item()
+                }
+
+        for i in pending:
+            quality_heatmaps, pathology_heatmaps = heatmaps[i] if compute_heatmaps and i in heatmaps else (None, None)
+            results[i] = self._make_result(img_names[i], imgs[i], records[i], quality_heatmaps, pathology_heatmaps, cropped_imgs.get(i))
+            if self.cache is not None:
+                with metrics.time('cache_put'):
+                    self.cache.put(cache_keys[i], records[i], quality_heatmaps, pathology_heatmaps)
+
+        return results
@@ -0,0 +1,105 @@
+"""
+Реестр моделей: пути к чекпоинтам конвейера, их SHA-256 и версия набора.
+Версия и ожидаемые хэши задаются необязательным файлом registry.json в папке моделей;
+его можно записать командой `python -m spina_bifida.registry models --version 2024.10`.
+"""
+import os
+import json
+import hashlib
+import argparse
+import threading
+
+# Имя модели -> файл чекпоинта в папке моделей
+MODEL_FILES = {
+    'detector': 'best_object_detection.pt',
+    'axial_quality': 'axial_quality.pt',
+    'axial_pathology': 'axial_pathology.pt',
+    'sagittal_quality': 'sagittal_quality.pt',
+    'sagittal_pathology': 'sagittal_pathology.pt',
+}
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 ** 2), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ModelRegistry:
+    """
+    Детектор и четыре классификатора (плоскость x задача) с хэшами содержимого.
+    fingerprint зависит только от содержимого чекпоинтов и используется как версия моделей
+    в кэше результатов и артефактах; version - необязательная человекочитаемая метка набора.
+    """
+    manifest_name = 'registry.json'
+
+    def __init__(self, paths, version=None, expected_checksums=None):
+        self.paths = dict(paths)
+        self.version = version
+        self.expected_checksums = expected_checksums or {}
+        self._checksums = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_dir(cls, models_dir):
+        paths = {name: os.path.join(models_dir, file_name) for name, file_name in MODEL_FILES.items()}
+        manifest_path = os.path.join(models_dir, cls.manifest_name)
+        if not os.path.exists(manifest_path):
+            return cls(paths)
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        return cls(paths, manifest.get('version'), {name: model['sha256'] for name, model in manifest['models'].items()})
+
+    @property
+    def detector_path(self):
+        return self.paths['detector']
+
+    def classifier_path(self, plane_name, task):
+        return self.paths[f'{plane_name}_{task}']
+
+    def checksum(self, name):
+        if name not in self._checksums:
+            checksum = file_checksum(self.paths[name])
+            with self._lock:
+                self._checksums[name] = checksum
+        return self._checksums[name]
+
+    def checksums(self):
+        return {name: self.checksum(name) for name in self.paths}
+
+    @property
+    def fingerprint(self):
+        digest = hashlib.sha256()
+        for name, checksum in sorted(self.checksums().items()):
+            digest.update(f'{name}:{checksum}\n'.encode())
+        return digest.hexdigest()[:16]
+
+    def verify(self):
+        """
+        Сверка чекпоинтов с хэшами из registry.json; при расхождении - ValueError.
+        """
+        mismatched = [name for name, checksum in self.expected_checksums.items() if self.checksum(name) != checksum]
+        if mismatched:
+            raise ValueError(f"Model checkpoints do not match {self.manifest_name} (version {self.version}): {mismatched}")
+
+    def describe(self):
+        return {
+            "version": self.version,
+            "fingerprint": self.fingerprint,
+            "models": {name: {"path": path, "sha256": self.checksum(name)} for name, path in self.paths.items()}
+        }
+
+    def write_manifest(self, models_dir, version):
+        with open(os.path.join(models_dir, self.manifest_name), 'w') as f:
+            json.dump({"version": version, "models": {name: {"file": os.path.basename(path), "sha256": self.checksum(name)}
+                                                      for name, path in self.paths.items()}}, f, indent=2)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Record checkpoint hashes and a version label in registry.json')
+    parser.add_argument('models_dir')
+    parser.add_argument('--version', required=True)
+    args = parser.parse_args()
+
+    registry = ModelRegistry.from_dir(args.models_dir)
+    registry.write_manifest(args.models_dir, args.version)
+    print(json.dumps(ModelRegistry.from_dir(args.models_dir).describe(), indent=2))
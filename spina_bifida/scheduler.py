@@ -0,0 +1,115 @@
+import time
+import queue
+import threading
+import collections
+from concurrent.futures import Future, ThreadPoolExecutor
+
+class BatchScheduler:
+    """
+    Микро-батчинг запросов из параллельных сессий к общему MedicalImageProcessor.
+    Запросы копятся до max_batch_size изображений или max_wait_ms, затем выполняются одним вызовом
+    process_batch в единственном рабочем потоке; каждый вызывающий получает свой результат через Future.
+    """
+    def __init__(self, processor, max_wait_ms=15, max_batch_size=16):
+        self.processor = processor
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='batch-scheduler', daemon=True)
+        self._thread.start()
+
+    @property
+    def model_version(self):
+        return self.processor.model_version
+
+    def submit(self, img, img_name, compute_heatmaps=True):
+        future = Future()
+        self._queue.put((img, img_name, compute_heatmaps, future))
+        return future
+
+    def process_image(self, img, img_name, compute_heatmaps=True):
+        return self.submit(img, img_name, compute_heatmaps).result()
+
+    def score_image(self, img, img_name):
+        return self.process_image(img, img_name, compute_heatmaps=False)
+
+    def roi_heatmaps(self, cropped_img, plane):
+        # Grad-CAM++ одной области не пакетируется: хуки get_prediction_and_cam разделены по потокам
+        return self.processor.roi_heatmaps(cropped_img, plane)
+
+    def process_batch(self, images, compute_heatmaps=True, batch_size=None):
+        futures = [self.submit(img, img_name, compute_heatmaps) for img, img_name in images]
+        return [future.result() for future in futures]
+
+    def _submit_decoded(self, decoding, img_name, compute_heatmaps):
+        # Запрос попадает в очередь модели, как только изображение декодировано
+        future = Future()
+
+        def on_decoded(decoded):
+            try:
+                img = decoded.result()
+            except Exception as e:
+                future.set_exception(e)
+                return
+            self._queue.put((img, img_name, compute_heatmaps, future))
+
+        decoding.add_done_callback(on_decoded)
+        return future
+
+    def process_stream(self, images, compute_heatmaps=True, batch_size=None, workers=4, prefetch=32):
+        """
+        Потоковая обработка: изображения декодируются в пуле потоков и передаются в общую очередь модели
+        по мере готовности, в работе не более prefetch изображений.
+        Результаты выдаются в порядке входа, как только готовы.
+        """
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='decode') as executor:
+            pending = collections.deque()
+            for img, img_name in images:
+                pending.append(self._submit_decoded(executor.submit(self.processor._open_image, img), img_name, compute_heatmaps))
+                if len(pending) >= prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _collect(self):
+        pending = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(pending) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                pending.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return pending
+
+    def _run(self):
+        while True:
+            pending = self._collect()
+            # Запросы с тепловыми картами и без выполняются разными пакетами
+            for compute_heatmaps in (False, True):
+                group = [request for request in pending if request[2] == compute_heatmaps]
+                if not group:
+                    continue
+                try:
+                    results = self.processor.process_batch(
+                        [(img, img_name) for img, img_name, heatmaps, future in group],
+                        compute_heatmaps=compute_heatmaps,
+                        batch_size=self.max_batch_size,
+                    )
+                except Exception:
+                    # Ошибка одного изображения не должна ронять запросы других сессий из того же пакета:
+                    # изображения пакета повторяются по одному, исключение получает только сбойный запрос
+                    for request in group:
+                        self._run_one(*request)
+                    continue
+                for (img, img_name, heatmaps, future), result in zip(group, results):
+                    future.set_result(result)
+
+    def _run_one(self, img, img_name, compute_heatmaps, future):
+        try:
+            future.set_result(self.processor.process_batch([(img, img_name)], compute_heatmaps=compute_heatmaps)[0])
+        except Exception as e:
+            future.set_exception(e)
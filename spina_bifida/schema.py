@@ -0,0 +1,41 @@
+"""
+Схема результата обработки кадра, общая для MedicalImageProcessor, InferenceClient и ExampleArtifact.
+
+Результат:
+    {"img_name": str, "rois": [roi, ...], **rois[0]}
+    Области интереса идут по убыванию уверенности детектора, поля основной (первой) продублированы на верхнем уровне.
+roi:
+    {
+        "cropped_img": PIL.Image,
+        "plane": {"box": [x1, y1, x2, y2], "prediction_prob": float, "plane": SAGITTAL | AXIAL},
+        "quality": {"prediction_prob": float, "heatmap": PIL.Image | None},
+        "pathology": {"prediction_prob": float, "heatmap": PIL.Image | None}
+    }
+Ошибка (область интереса не найдена):
+    {"img_name": str, "error": str}
+
+Названия плоскостей в результат не входят: приложения локализуют номер плоскости сами.
+Несовместимые изменения схемы увеличивают RESULT_SCHEMA_VERSION.
+"""
+import numpy as np
+
+RESULT_SCHEMA_VERSION = 1
+
+# Классы детектора
+SAGITTAL = 1
+AXIAL = 2
+PLANE_NAMES = {SAGITTAL: 'sagittal', AXIAL: 'axial'}
+
+def make_roi(cropped_img, box, conf, plane, quality, pathology, quality_heatmap=None, pathology_heatmap=None):
+    return {
+        "cropped_img": cropped_img,
+        "plane": {"box": [np.float32(x) for x in box], "prediction_prob": np.float32(conf), "plane": int(plane)},
+        "quality": {"prediction_prob": np.round(quality, 2), "heatmap": quality_heatmap},
+        "pathology": {"prediction_prob": np.round(pathology, 2), "heatmap": pathology_heatmap}
+    }
+
+def make_result(img_name, rois):
+    return {"img_name": img_name, **rois[0], "rois": rois}
+
+def make_error(img_name, error):
+    return {"img_name": img_name, "error": error}
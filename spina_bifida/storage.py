@@ -0,0 +1,158 @@
+import io
+import time
+import sqlite3
+import logging
+import mimetypes
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+from .telemetry import metrics
+
+logger = logging.getLogger(__name__)
+
+class S3Uploader:
+    """
+    Загрузка в Object Storage через один общий клиент boto3 (с пулом соединений) и ограниченный пул потоков.
+    Данные передаются из памяти, без временных файлов; большие объекты загружаются по частям (multipart).
+    Повторные попытки с экспоненциальной задержкой выполняет botocore (режим 'standard').
+    """
+    def __init__(self, bucket, access_key, secret_key, endpoint_url='https://storage.yandexcloud.net', max_workers=8, max_attempts=5,
+                 multipart_threshold=8 * 1024 ** 2):
+        self.bucket = bucket
+        config = Config(max_pool_connections=max_workers * 2, retries={'max_attempts': max_attempts, 'mode': 'standard'})
+        self.client = boto3.session.Session().client(
+            service_name='s3',
+            endpoint_url=endpoint_url,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            config=config
+        )
+        self.transfer_config = TransferConfig(multipart_threshold=multipart_threshold, multipart_chunksize=multipart_threshold, max_concurrency=2)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='s3-upload')
+
+    def _upload(self, data, object_name):
+        content_type = mimetypes.guess_type(object_name)[0] or 'application/octet-stream'
+        try:
+            with metrics.time('upload'):
+                self.client.upload_fileobj(
+                    io.BytesIO(data),
+                    self.bucket,
+                    object_name,
+                    ExtraArgs={'ContentType': content_type},
+                    Config=self.transfer_config
+                )
+        except Exception:
+            metrics.count('upload_failure')
+            raise
+        metrics.count('upload_bytes', len(data))
+
+    def upload(self, data, object_name):
+        return self.executor.submit(self._upload, data, object_name)
+
+class UploadQueue:
+    """
+    Персистентная очередь загрузок в Object Storage на SQLite: enqueue сразу возвращает управление,
+    объекты загружает фоновый поток через S3Uploader. Незагруженные объекты переживают перезапуск,
+    неудачные загрузки повторяются с экспоненциальной задержкой.
+    Взятая в работу запись блокируется на lease_seconds, поэтому одну очередь могут разбирать несколько процессов.
+    """
+    def __init__(self, path, uploader, batch_size=16, poll_interval=1.0, max_backoff=300, lease_seconds=600):
+        self.path = path
+        self.uploader = uploader
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self.lease_seconds = lease_seconds
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS uploads ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, object_name TEXT NOT NULL, data BLOB NOT NULL, '
+                'created REAL NOT NULL, next_attempt REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, last_error TEXT)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS uploads_next_attempt ON uploads (next_attempt)')
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='upload-queue', daemon=True)
+        self._thread.start()
+
+    @contextlib.contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def enqueue(self, objects):
+        """
+        Поставить в очередь список пар (данные в bytes, имя объекта).
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany(
+                'INSERT INTO uploads (object_name, data, created, next_attempt) VALUES (?, ?, ?, ?)',
+                [(object_name, data, now, now) for data, object_name in objects]
+            )
+        self._wakeup.set()
+
+    def stats(self):
+        """
+        Глубина очереди, задержка самого старого объекта (в секундах) и число объектов с неудачными попытками.
+        """
+        with self._connect() as connection:
+            depth, oldest, failing = connection.execute(
+                'SELECT COUNT(*), MIN(created), COALESCE(SUM(attempts > 0), 0) FROM uploads'
+            ).fetchone()
+        return {"depth": depth, "lag": time.time() - oldest if oldest is not None else 0.0, "failing": failing}
+
+    def _claim(self):
+        now = time.time()
+        with self._connect() as connection:
+            return connection.execute(
+                'UPDATE uploads SET next_attempt = ? WHERE id IN '
+                '(SELECT id FROM uploads WHERE next_attempt <= ? ORDER BY id LIMIT ?) '
+                'RETURNING id, object_name, data, attempts',
+                (now + self.lease_seconds, now, self.batch_size)
+            ).fetchall()
+
+    def _run(self):
+        while True:
+            try:
+                claimed = self._claim()
+            except sqlite3.Error:
+                logger.exception('Upload queue is not available')
+                claimed = []
+            if not claimed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            futures = {self.uploader.upload(data, object_name): (upload_id, object_name, attempts) for upload_id, object_name, data, attempts in claimed}
+            for future in as_completed(futures):
+                upload_id, object_name, attempts = futures[future]
+                try:
+                    self._finish(future, upload_id, object_name, attempts)
+                except sqlite3.Error:
+                    # Запись остается заблокированной до истечения lease_seconds и будет загружена повторно
+                    logger.exception('Cannot update upload queue entry for %s', object_name)
+
+    def _finish(self, future, upload_id, object_name, attempts):
+        try:
+            future.result()
+        except Exception as e:
+            logger.warning('Upload of %s failed (attempt %d): %s', object_name, attempts + 1, e)
+            delay = min(2 ** attempts, self.max_backoff)
+            with self._connect() as connection:
+                connection.execute(
+                    'UPDATE uploads SET attempts = attempts + 1, next_attempt = ?, last_error = ? WHERE id = ?',
+                    (time.time() + delay, str(e), upload_id)
+                )
+        else:
+            with self._connect() as connection:
+                connection.execute('DELETE FROM uploads WHERE id = ?', (upload_id,))
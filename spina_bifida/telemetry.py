@@ -0,0 +1,50 @@
+import contextlib
+import threading
+
+class Metrics:
+    """
+    Метрики конвейера в формате Prometheus: длительность стадий, счетчики событий и время загрузки моделей.
+    По умолчанию выключены: time() возвращает общий пустой контекст, count() ничего не делает,
+    prometheus_client не импортируется.
+    """
+    def __init__(self, namespace='spina_bifida'):
+        self.namespace = namespace
+        self.enabled = False
+        self._lock = threading.Lock()
+
+    def enable(self, port=None):
+        """
+        Включение метрик (повторные вызовы ничего не делают).
+        При заданном port в фоновом потоке запускается экспортер для Prometheus (GET /metrics).
+        """
+        with self._lock:
+            if self.enabled:
+                return
+            from prometheus_client import Counter, Histogram, start_http_server
+
+            self._stages = Histogram('stage_seconds', 'Duration of pipeline stages', ['stage'], namespace=self.namespace)
+            self._events = Counter('events', 'Pipeline events', ['event'], namespace=self.namespace)
+            self._model_loads = Histogram('model_load_seconds', 'Model load time', ['model'], namespace=self.namespace,
+                                          buckets=(0.1, 0.5, 1, 2, 5, 10, 30, 60, float('inf')))
+            if port:
+                start_http_server(port)
+            self.enabled = True
+
+    def time(self, stage):
+        if not self.enabled:
+            return _NO_TIMER
+        return self._stages.labels(stage).time()
+
+    def time_model_load(self, model):
+        if not self.enabled:
+            return _NO_TIMER
+        return self._model_loads.labels(model).time()
+
+    def count(self, event, n=1):
+        if self.enabled and n:
+            self._events.labels(event).inc(n)
+
+_NO_TIMER = contextlib.nullcontext()
+
+# Общие метрики процесса; включаются приложением (METRICS_PORT)
+metrics = Metrics()
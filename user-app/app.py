@@ -2,14 +2,13 @@ import streamlit as st
 from streamlit_image_select import image_select
 
 import numpy as np
-from PIL import Image
-import torch
 from stqdm import stqdm
-import io
-from utils import *
+import hashlib
+from spina_bifida import ExampleArtifact, decode_image, enable_metrics_from_env, processor_from_env, upload_queue_from_env
+import logging
+import threading
+import cachetools
 import os
-import boto3
-from botocore.exceptions import NoCredentialsError
 from dotenv import load_dotenv
 import uuid
 import json
@@ -18,15 +17,22 @@ import gettext
 # BugFix SSL error
 import ssl
 ssl._create_default_https_context = ssl._create_unverified_context
+
+logger = logging.getLogger(__name__)
     
 # Форма обратной связи
 form_data = {}
 
 # Загрузка переменных окружения из .env файла
 load_dotenv()
-BUCKET = os.getenv('BUCKET')
+DECODE_MAX_SIZE = int(os.getenv('DECODE_MAX_SIZE') or 0) or None
+INFERENCE_URL = os.getenv('INFERENCE_URL')
+EXAMPLES_ARTIFACT = os.getenv('EXAMPLES_ARTIFACT') or 'example_images/examples.zip'
 IFRAME = '<iframe src="https://ghbtns.com/github-btn.html?user=yandex-cloud-socialtech&repo=spina-bifida&type=watch&count=true&size=large" frameborder="0" scrolling="0" width="121" height="30" title="GitHub"></iframe>'
 
+# Метрики стадий обработки и загрузок (экспортер Prometheus на METRICS_PORT, запускается один раз на процесс)
+enable_metrics_from_env()
+
 # Настройки страницы
 st.set_page_config(
      page_title='Spina bifida',
@@ -42,6 +48,9 @@ try:
 except:
     pass
 
+# Названия плоскостей для результатов из артефакта примеров (на языке текущей сессии)
+plane_type = {1: _('сагиттальной'), 2: _('аксиальной')}
+
 ###########
 # Функции #
 ###########
@@ -73,79 +82,124 @@ def show_terms_modal():
 
     return accept
 
-# Функция записи обратной связи на S3
-def upload_to_yandex_cloud(file_name, bucket, object_name=None):
-    ACCESS_KEY = os.getenv('ACCESS_KEY')
-    SECRET_KEY = os.getenv('SECRET_KEY')
-    ENDPOINT_URL = 'https://storage.yandexcloud.net'
-
-    session = boto3.session.Session()
-    s3 = session.client(
-        service_name='s3',
-        endpoint_url=ENDPOINT_URL,
-        aws_access_key_id=ACCESS_KEY,
-        aws_secret_access_key=SECRET_KEY
-    )
+# Очередь загрузок в Object Storage: один клиент, пул потоков и фоновый поток на процесс
+@st.cache_resource
+def get_upload_queue():
+    return upload_queue_from_env(default_workers=4)
 
-    try:
-        s3.upload_file(file_name, bucket, object_name or file_name)
-        st.success(_("Файл {} успешно загружен в Yandex Object Storage.").format(file_name))
-        # Удаление локального файла после успешной загрузки
-        os.remove(file_name)
-    except FileNotFoundError:
-        st.error(_("Файл не найден."))
-    except NoCredentialsError:
-        st.error(_("Ошибка с учетными данными."))
-    except Exception as e:
-        st.error(_("Произошла ошибка: {}").format(e))
+# Функция записи обратной связи на S3 (objects - список пар: данные в bytes, имя объекта).
+# Объекты ставятся в очередь и загружаются в фоне, кнопка "Отправить" не ждет Object Storage
+def upload_to_yandex_cloud(objects):
+    upload_queue.enqueue(objects)
+    for data, object_name in objects:
+        st.success(_("Файл {} поставлен в очередь на загрузку в Yandex Object Storage.").format(object_name))
 
 # Функция настройки моделей
 @st.cache_resource(show_spinner = "Load model ...")
 def get_processor():
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    return MedicalImageProcessor(
-        yolo_model_path='models/best_object_detection.pt',
-        axial_quality_model_path='models/axial_quality.pt',
-        axial_pathology_model_path='models/axial_pathology.pt',
-        sagittal_quality_model_path='models/sagittal_quality.pt',
-        sagittal_pathology_model_path='models/sagittal_pathology.pt',
-        device=device
-    )
+    # Процессор общий для всех сессий: одновременные запросы объединяются в пакеты и выполняются в одном потоке.
+    # Если задан адрес сервиса инференса (INFERENCE_URL), модели в процессе Streamlit не загружаются
+    return processor_from_env('models', default_max_rois=1)
 
-# Функции обработки изображений
-@st.cache_data(show_spinner = "Image processing ...", ttl = 3600, max_entries = 100)
-def cache_process_image(img_bytes, img_name):
-    return processor.process_image(img_bytes, img_name)
+# Предрассчитанные результаты встроенных примеров (build_examples.py).
+# Используются, только если собраны текущей версией моделей, иначе примеры обрабатываются моделями
+@st.cache_resource
+def get_example_artifact():
+    if not os.path.exists(EXAMPLES_ARTIFACT):
+        return None
+    try:
+        artifact = ExampleArtifact.load(EXAMPLES_ARTIFACT)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning('Example artifact %s is not usable: %s', EXAMPLES_ARTIFACT, e)
+        return None
+    if artifact.model_version != processor.model_version:
+        logger.warning('Example artifact %s was built for model version %s, current is %s', EXAMPLES_ARTIFACT, artifact.model_version, processor.model_version)
+        return None
+    return artifact
 
 # Функции обработки изображений
-def process_uploaded_files(uploaded_files):
-        with stqdm(uploaded_files, mininterval=1) as pbar:
-            st.session_state['imgs'] = {}
-            st.session_state['processed_images'] = {}
-            for uploaded_file in pbar:
-                img = Image.open(uploaded_file)
-                img_bytes = io.BytesIO()
-                img.save(img_bytes, format='PNG')
-                img_bytes = img_bytes.getvalue()
-                img_name = uploaded_file.name
-                if img_name not in st.session_state['imgs']:
-                    result = cache_process_image(img_bytes, img_name)
-                    st.session_state['imgs'][img_name] = img
-                    st.session_state['processed_images'][img_name] = result
-    
-def process_example_files(example_files):
+# Сначала считаются только вероятности, тепловые карты строятся позже (cache_heatmaps)
+
+# Тепловые карты Grad-CAM++ одного снимка: строятся при первом показе вкладок и кэшируются.
+# Используются область интереса и плоскость из результата оценки, детекция не повторяется
+@st.cache_data(show_spinner = "Heatmap processing ...", ttl = 3600, max_entries = 100)
+def cache_heatmaps(image_key, img_name, _cropped_img, plane):
+    return processor.roi_heatmaps(_cropped_img, plane)
+
+# Результаты оценки, общие для всех сессий процесса (ключ - SHA-256 файла и имя): новые сессии
+# не пересчитывают уже оцененные снимки, в том числе встроенные примеры без артефакта
+@st.cache_resource
+def get_shared_results():
+    return cachetools.TTLCache(maxsize=100, ttl=3600), threading.Lock()
+
+# Вход модели для снимка: сервису инференса передаются исходные байты файла без перекодирования в PNG,
+# кроме случая уменьшенного декодирования (DECODE_MAX_SIZE) - тогда оценивается уменьшенное изображение
+def model_input(img_name):
+    if INFERENCE_URL and not DECODE_MAX_SIZE:
+        return st.session_state['files'][img_name]
+    return st.session_state['imgs'][img_name]
+
+def get_heatmaps(img_name):
+    result = st.session_state['processed_images'][img_name]
+    # Результаты из артефакта примеров уже содержат тепловые карты
+    if result["quality"]["heatmap"] is not None:
+        return result["quality"]["heatmap"], result["pathology"]["heatmap"]
+    return cache_heatmaps(st.session_state['keys'][img_name], img_name, result["cropped_img"], result["plane"]["plane"])
+
+def process_images(files, artifact=None, progress=None):
+    """
+    Обработка изображений, files - список пар (байты файла, имя).
+    Каждый файл декодируется один раз, декодированное изображение передается в модели напрямую
+    (сервису инференса - исходные байты файла, см. model_input).
+    Файлы, уже обработанные в этой сессии или другими сессиями процесса (по SHA-256 байтов файла и имени)
+    или найденные в artifact (ExampleArtifact), в модели не передаются.
+    progress - обертка для потока результатов (например, stqdm).
+    """
+    cached = st.session_state.get('results', {})
+    shared, shared_lock = get_shared_results()
+    st.session_state['results'] = {}
     st.session_state['imgs'] = {}
+    st.session_state['files'] = {}
+    st.session_state['keys'] = {}
     st.session_state['processed_images'] = {}
-    for example_file in example_files:
-        img = Image.open(example_file)
-        img_bytes = io.BytesIO()
-        img.save(img_bytes, format='PNG')
-        img_bytes = img_bytes.getvalue()
-        img_name = example_file
+    batch = []
+    batch_key = []
+    for file_bytes, img_name in files:
         if img_name not in st.session_state['imgs']:
-            result = cache_process_image(img_bytes, img_name)
+            img = decode_image(file_bytes, DECODE_MAX_SIZE)
             st.session_state['imgs'][img_name] = img
-            st.session_state['processed_images'][img_name] = result
+            st.session_state['files'][img_name] = file_bytes
+            st.session_state['keys'][img_name] = hashlib.sha256(file_bytes).hexdigest()
+            key = (st.session_state['keys'][img_name], img_name)
+            result = cached.get(key)
+            if result is None:
+                with shared_lock:
+                    result = shared.get(key)
+            if result is None and artifact is not None:
+                result = artifact.get(key[0], img_name)
+            if result is not None:
+                st.session_state['results'][key] = st.session_state['processed_images'][img_name] = result
+                continue
+            batch.append((model_input(img_name), img_name))
+            batch_key.append(key)
+    if batch:
+        stream = processor.process_stream(batch, compute_heatmaps=False)
+        if progress is not None:
+            stream = progress(stream, total=len(batch), mininterval=1)
+        for key, result in zip(batch_key, stream):
+            st.session_state['results'][key] = st.session_state['processed_images'][key[1]] = result
+            with shared_lock:
+                shared[key] = result
+
+def process_uploaded_files(uploaded_files):
+    process_images([(uploaded_file.getvalue(), uploaded_file.name) for uploaded_file in uploaded_files], progress=stqdm)
+    
+def process_example_files(example_files):
+    files = []
+    for example_file in example_files:
+        with open(example_file, 'rb') as f:
+            files.append((f.read(), example_file))
+    process_images(files, get_example_artifact(), progress=stqdm)
 
 # Функция генерации уникального идентификатора файла
 def get_unique_id():
@@ -222,6 +276,7 @@ else:
         uploaded_files = uploaded_files[:2]
     
     processor = get_processor()
+    upload_queue = get_upload_queue()
     
     if 'feedback' not in st.session_state:
         st.session_state['feedback'] = {}
@@ -261,10 +316,10 @@ else:
                 
                 with tabs[0]:
                     st.image(selected_image_data['cropped_img'], use_column_width=True)
-                    st.markdown(_('Голова в {} плоскости с вероятностью **:red[{}%]**').format(selected_image_data["plane"]["type"], int(selected_image_data["plane"]["prediction_prob"]*100)))
+                    st.markdown(_('Голова в {} плоскости с вероятностью **:red[{}%]**').format(plane_type[selected_image_data["plane"]["plane"]], int(selected_image_data["plane"]["prediction_prob"]*100)))
                     
                 with tabs[1]:
-                    quality_image = selected_image_data["quality"]["heatmap"]
+                    quality_image, pathology_image = get_heatmaps(option)
                     st.image(quality_image, use_column_width=True)
                     st.markdown(_('Изображение качественное с вероятностью **:red[{}%]**').format(int(selected_image_data["quality"]["prediction_prob"]*100)))
                     st.markdown("---")
@@ -274,7 +329,6 @@ else:
                     st.markdown(_("**Синий/темный:** Области, незначительные для качества изображения."))
                 
                 with tabs[2]:
-                    pathology_image = selected_image_data["pathology"]["heatmap"]
                     st.image(pathology_image, use_column_width=True)
                     st.markdown(_('На изображении присутствует патология с вероятностью **:red[{}%]**').format(int(selected_image_data["pathology"]["prediction_prob"]*100)))
                     st.markdown("---")
@@ -303,10 +357,10 @@ else:
                 
                 with tabs[0]:
                     st.image(selected_image_data['cropped_img'], use_column_width=True)
-                    st.markdown(_('Голова в {} плоскости с вероятностью **:red[{}%]**').format(selected_image_data["plane"]["type"], int(selected_image_data["plane"]["prediction_prob"]*100)))
+                    st.markdown(_('Голова в {} плоскости с вероятностью **:red[{}%]**').format(plane_type[selected_image_data["plane"]["plane"]], int(selected_image_data["plane"]["prediction_prob"]*100)))
                     
                 with tabs[1]:
-                    quality_image = selected_image_data["quality"]["heatmap"]
+                    quality_image, pathology_image = get_heatmaps(str(example_img))
                     st.image(quality_image, use_column_width=True)
                     st.markdown(_('Изображение качественное с вероятностью **:red[{}%]**').format(int(selected_image_data["quality"]["prediction_prob"]*100)))
                     st.markdown("---")
@@ -316,7 +370,6 @@ else:
                     st.markdown(_("**Синий/темный:** Области, незначительные для качества изображения."))
                     
                 with tabs[2]:
-                    pathology_image = selected_image_data["pathology"]["heatmap"]
                     st.image(pathology_image, use_column_width=True)
                     st.markdown(_('На изображении присутствует патология с вероятностью **:red[{}%]**').format(int(selected_image_data["pathology"]["prediction_prob"]*100)))
                     st.markdown("---")
@@ -357,18 +410,11 @@ else:
         form_data["new_image_name"] = img_file_name
         form_data["patology_prediction"] = int(selected_image_data["pathology"]["prediction_prob"]*100)
         form_data["quality_prediction"] = int(selected_image_data["quality"]["prediction_prob"]*100)
-        form_data["plane_type"] = selected_image_data["plane"]["type"]
+        form_data["plane_type"] = plane_type[selected_image_data["plane"]["plane"]]
         form_data["action"] = action
     
-        # Сохранение данных формы в JSON файл (временно)
-        with open(json_file_name, 'w') as f:
-            json.dump(form_data, f)
-
-        # Сохранение выбранного изображения (временно)
-        st.session_state['imgs'][option].save(img_file_name)
-
-        # Загрузка JSON файла в Yandex Object Storage
-        upload_to_yandex_cloud(json_file_name, BUCKET)
-        
-        # Загрузка оригинального файла в Yandex Object Storage
-        upload_to_yandex_cloud(img_file_name, BUCKET)
+        # Загрузка JSON с фидбэком и оригинального файла в Yandex Object Storage
+        upload_to_yandex_cloud([
+            (json.dumps(form_data).encode(), json_file_name),
+            (st.session_state['files'][option], img_file_name)
+        ])
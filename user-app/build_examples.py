@@ -0,0 +1,35 @@
+import argparse
+import glob
+import os
+
+import torch
+
+from spina_bifida import ExampleArtifact, MedicalImageProcessor
+
+# Предрасчет результатов и тепловых карт для example_images/*.jpg (артефакт EXAMPLES_ARTIFACT).
+# Запускать после каждого обновления моделей: приложение игнорирует артефакт другой версии моделей
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute results for the bundled example images')
+    parser.add_argument('--models-dir', default='models')
+    parser.add_argument('--examples-dir', default='example_images')
+    parser.add_argument('--output', default=os.path.join('example_images', 'examples.zip'))
+    parser.add_argument('--backend', default=os.getenv('INFERENCE_BACKEND') or 'torch')
+    parser.add_argument('--quantized', action='store_true')
+    args = parser.parse_args()
+
+    processor = MedicalImageProcessor.from_models_dir(
+        args.models_dir,
+        device=torch.device('cpu'),
+        backend=args.backend,
+        quantized=args.quantized
+    )
+
+    # Имена совпадают с путями примеров в app.py
+    files = []
+    for path in sorted(glob.glob(os.path.join(args.examples_dir, '*.jpg'))):
+        with open(path, 'rb') as f:
+            files.append((f.read(), path))
+
+    artifact = ExampleArtifact.build(processor, files)
+    artifact.save(args.output)
+    print(f'{args.output}: {len(files)} examples, model version {artifact.model_version}')